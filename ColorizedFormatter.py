@@ -18,6 +18,7 @@ __email__ = "dwakefieldmail-git@yahoo.co.uk"
 __status__ = "prototype"
 
 from enum import Enum
+import copy
 import logging
 
 ERROR = 1
@@ -26,6 +27,13 @@ LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
 
 class Color:
+    """
+    256 color terminal escape codes by name, or by number as a string.
+    
+    The codes are built the first time one is asked for and shared by
+    every instance. FGColor and BGColor, Enums of the same codes, are
+    only built if they are used as they are slow to create.
+    """
     _colors = { "dk_red":  52, "lt_red": 1, "red": 1,
                 "dk_green": 28, "lt_green": 84,"green": 2,
                 "dk_yellow": 142, "lt_yellow": 192, "yellow": 3,
@@ -36,27 +44,50 @@ class Color:
                 "white": 15, "black": 16
                 }
     
+    # {"fg": {name: code}, "bg": {name: code}}, filled in by _codes()
+    _palette = {}
+    _enums = {}
+    
     def __init__(self, fg_default="white", 
                 bg_default="black", combo_default=None):
         self.combo_default = combo_default
         self._combos = {"_default": {"fg": fg_default, "bg": bg_default}}
-        self._colors.update([(str(i), i) for i in range(1, 256)])
-        self.FGColor = Enum("FGColor", [(k, "\033[38;5;" + str(v) + "m") 
-                                for k,v in self._colors.iteritems()])
-        self.BGColor = Enum("BGColor", [(k, "\033[48;5;" + str(v) + "m") 
-                                for k,v in self._colors.iteritems()])
+    
+    @classmethod
+    def _codes(cls, type_):
+        if not cls._palette:
+            colors = dict(cls._colors)
+            colors.update([(str(i), i) for i in range(1, 256)])
+            cls._palette = {
+                "fg": dict((k, "\033[38;5;" + str(v) + "m")
+                           for k,v in colors.iteritems()),
+                "bg": dict((k, "\033[48;5;" + str(v) + "m")
+                           for k,v in colors.iteritems()),
+                }
+        
+        return cls._palette[type_]
+    
+    def __getattr__(self, name):
+        # FGColor and BGColor
+        if name not in ("FGColor", "BGColor"):
+            raise AttributeError(name)
+        
+        if name not in Color._enums:
+            codes = self._codes(name[:2].lower())
+            Color._enums[name] = Enum(name, codes.items())
+        return Color._enums[name]
     
     def fg(self, s=None):
         if not (s or self._combos.has_key(s)):
             s = self._combos["_default"]["fg"]
         
-        return self.FGColor[s].value
+        return self._codes("fg")[s]
     
     def bg(self, s=None):
         if not (s or self._combos.has_key(s)):
             s = self._combos["_default"]["bg"]
         
-        return self.BGColor[s].value
+        return self._codes("bg")[s]
         
     def reset(self):
         return self.fg() + self.bg()
@@ -122,6 +153,11 @@ class ColorizedFormatter:
     be colorized with seperate calls to color with fg and bg, a combo color
     is needed instead.
     
+    The colored format for each level is built once, when the formatter is
+    created and again after colorize_level or colorize_attribute, and kept
+    in a formatter of its own. format() never changes shared state so it
+    can be called from several threads at once.
+    
     TODO: Change to inherited class, no need for it to be seperate.
     Add in some way to define different message formats depending on 
         the log level being called to format 
@@ -159,8 +195,35 @@ class ColorizedFormatter:
     def __init__(self, formatter=None, color_handler=None, reset=True):
         self.C = color_handler or Color()
         self.formatter = formatter or logging.Formatter()
-        self._uncolored_format = formatter._fmt
+        self._uncolored_format = self.formatter._fmt
         self.reset_attributes_color = reset
+        # Colors set on one instance should not leak into another
+        self._attributes = dict(self._attributes)
+        self._levels = dict(self._levels)
+        self._compile()
+    
+    def _formatter(self, fmt):
+        # A copy keeps datefmt and any overridden methods of the original
+        f = copy.copy(self.formatter)
+        f._fmt = fmt
+        return f
+    
+    def _compile(self):
+        colored_format = self._uncolored_format
+        
+        for k,v  in self._attributes.iteritems():
+            if k != v:
+                colored_format = colored_format.replace(k, v)
+        
+        formatters = {}
+        for level, color in self._levels.iteritems():
+            if color:
+                formatters[level] = self._formatter(color + colored_format +
+                                                    self.C.reset())
+        
+        # Swapped in whole so a thread formatting meanwhile sees old or new
+        self._default = self._formatter(colored_format)
+        self._formatters = formatters
     
     def colorize_level(self, level, color, type_="fg"):
         if self._levels.has_key(level):
@@ -172,6 +235,8 @@ class ColorizedFormatter:
                 self._levels[level] = self.C.bg(color)
             elif (type_ == "combo"):
                 self._levels[level] = self.C.combo(color)
+            
+            self._compile()
     
     def colorize_attribute(self, attribute, color, type_="fg"):
         if self._attributes.has_key(attribute):
@@ -191,28 +256,14 @@ class ColorizedFormatter:
                     s = s + self.C.combo()
                 
             self._attributes[attribute] = s
+            self._compile()
         
     def format(self, record):
-        if self._levels.has_key(record.levelno):
-            if self._levels[record.levelno]:
-                return self._levels[record.levelno] + self.colorize(record) + self.C.reset()
-        
-        return self.colorize(record)
+        return self._formatters.get(record.levelno, self._default).format(record)
         
     def colorize(self, record):
-        colored_format = self._uncolored_format
-        
-        for k,v  in self._attributes.iteritems():
-            if k == v:
-                continue
-            else:
-                colored_format = colored_format.replace(k, v)
-            
-        self.formatter._fmt = colored_format
-        s = self.formatter.format(record)
-        self.formatter._fmt = self._uncolored_format
-        
-        return s
+        """ Formats record with the attribute colors but not the level's """
+        return self._default.format(record)
     
     def deep_colorize(self, record):
         raise NotImplementedError("Implement this method to get coloring inside\
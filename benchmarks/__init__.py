@@ -0,0 +1,11 @@
+"""
+Benchmarks for fix_nums.
+
+    python -m benchmarks.suite       parse, purge, render and relocate times
+    python -m benchmarks.corpus      print the generated release names
+    python benchmarks/bench_strip.py
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_processes.py
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_pipeline.py
+"""
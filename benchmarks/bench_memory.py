@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Peak memory of a dry run against the number of files.
+
+    python benchmarks/bench_memory.py [sizes]
+
+Each size is run in its own process, streaming generated names spread over
+directories of 1000 through file_objects() and a dry run Processor, and
+the growth in peak resident size over the process after start up is
+reported. Every name goes to a different destination, as in a real
+archive, so collision checks have something to remember.
+"""
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fix_nums
+from benchmarks import corpus
+
+SIZES = [50000, 100000, 200000, 400000]
+
+
+def names(count):
+    """ Generator of count names with distinct destinations """
+    for i in xrange(count):
+        # Shows of 100 seasons of 20 episodes
+        show = corpus.SHOWS[i // 2000 % len(corpus.SHOWS)].replace(" ", ".")
+        yield "inbox/{0:05d}/{1}.{2}.S{3:02d}E{4:02d}.720p.HDTV.x264.mkv"\
+              .format(i // 1000, show, i // 2000, i // 20 % 100 + 1,
+                      i % 20 + 1)
+
+
+def peak_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(count):
+    logging.getLogger().setLevel(logging.WARNING)
+    fix_nums.OPTS["DRYRUN"] = True
+    fix_nums.OPTS["OUTPUTDIR"] = tempfile.mkdtemp()
+
+    found = ((n, None) for n in names(count))
+    processor = fix_nums.Processor()
+    before = peak_kb()
+    processor.process(fix_nums.file_objects(found))
+    os.rmdir(fix_nums.OPTS["OUTPUTDIR"])
+    print before, peak_kb()
+
+
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["--child"]:
+        return child(int(argv[1]))
+    sizes = [int(a) for a in argv] or SIZES
+
+    print "{0:>9} {1:>10} {2:>10} {3:>12}".format("files", "start MB",
+                                                  "peak MB", "bytes/file")
+    for count in sizes:
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                       "--child", str(count)])
+        before, after = [int(x) for x in out.split()]
+        print "{0:>9} {1:>10.1f} {2:>10.1f} {3:>12.0f}".format(
+              count, before / 1024.0, after / 1024.0,
+              (after - before) * 1024.0 / count)
+
+
+if __name__ == "__main__":
+    main()
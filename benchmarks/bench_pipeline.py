@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Wall time of a copying run with the stages in turn and side by side.
+
+    python benchmarks/bench_pipeline.py [files] [KB per file]
+
+An inbox of generated names is copied into an empty library with
+--queue 0, which scans, parses and relocates in turn on one thread, and
+with the default queue, which runs them side by side. A dry run gives the
+time of scanning and parsing alone for comparison. The time until the
+first file has been copied is shown too.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarks import corpus
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                      "fix_nums.py")
+
+
+def timed_run(argv, cwd, env):
+    """ (seconds to the first success, seconds in all) for running argv """
+    start = time.time()
+    p = subprocess.Popen(argv, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    first = None
+    for line in iter(p.stdout.readline, ""):
+        if first == None and "| Success" in line:
+            first = time.time() - start
+    p.wait()
+    took = time.time() - start
+    return first or took, took
+
+
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+    count = int(argv[0]) if argv else 2000
+    size = int(argv[1]) * 1024 if len(argv) > 1 else 128 * 1024
+
+    home = tempfile.mkdtemp()
+    env = dict(os.environ, HOME=home)
+    inbox = os.path.join(home, "in")
+    os.mkdir(inbox)
+    data = os.urandom(size)
+    for style, name in corpus.generate(count):
+        with open(os.path.join(inbox, name.replace("/", "_")), "wb") as f:
+            f.write(data)
+
+    common = [sys.executable, SCRIPT, "-r", "--no-cache", "--no-manifest",
+              "--journal", "NONE"]
+    runs = [("scan + parse", ["-x"]), ("in turn", ["--queue", "0"]),
+            ("side by side", [])]
+
+    print "{0:>14} {1:>10} {2:>10}".format("", "first s", "total s")
+    try:
+        for label, extra in runs:
+            out = os.path.join(home, "out")
+            first, took = timed_run(common + extra + ["-o", out], inbox, env)
+            shutil.rmtree(out, True)
+            print "{0:>14} {1:>10.3f} {2:>10.3f}".format(label, first, took)
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Speed-up of --processes parsing against the number of processes.
+
+    python benchmarks/bench_processes.py [names] [most processes]
+
+Times parsing a generated corpus in this process and then on pools of 2,
+4, ... processes up to the number of CPUs. Pool start up is included as
+a real run pays for it too.
+"""
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fix_nums
+from benchmarks import corpus
+
+
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+    count = int(argv[0]) if argv else 100000
+    most = int(argv[1]) if len(argv) > 1 else multiprocessing.cpu_count()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    names = [n for style, n in corpus.generate(count)]
+    found = [(n, None) for n in names]
+
+    start = time.time()
+    for o in fix_nums.file_objects(found):
+        pass
+    serial = time.time() - start
+
+    print "{0:>9} {1:>10} {2:>8} {3:>10}".format("processes", "seconds",
+                                                 "speed-up", "efficiency")
+    print "{0:>9} {1:>10.2f} {2:>8.2f} {3:>10.0%}".format(1, serial, 1, 1)
+
+    processes = 2
+    while processes <= most:
+        start = time.time()
+        pool = fix_nums.ParsePool(processes)
+        for o in fix_nums.file_objects(found, pool=pool):
+            pass
+        pool.close()
+        took = time.time() - start
+
+        print "{0:>9} {1:>10.2f} {2:>8.2f} {3:>10.0%}".format(
+              processes, took, serial / took, serial / took / processes)
+        processes *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Times a whole invocation of fix_nums.py on a single new download, the way
+a download client runs it, from starting the interpreter to the first
+rename being reported.
+
+    python benchmarks/bench_startup.py [runs]
+
+HOME is pointed at a scratch directory so the default cache and journal
+are used without touching the real ones. The time to start an interpreter
+that does nothing is shown for comparison.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                      "fix_nums.py")
+
+NAME = "South.Park.S16E05.HDTV.x264-ASAP.mkv"
+
+
+def first_rename(argv, cwd, env):
+    """ Seconds from starting argv until it prints a successful rename """
+    start = time.time()
+    p = subprocess.Popen(argv, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    took = None
+    for line in iter(p.stdout.readline, ""):
+        if took == None and "| Success" in line:
+            took = time.time() - start
+    p.wait()
+    if took == None:
+        took = time.time() - start
+    return took
+
+
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+    runs = int(argv[0]) if argv else 20
+
+    home = tempfile.mkdtemp()
+    env = dict(os.environ, HOME=home)
+    base, script = [], []
+
+    try:
+        for i in range(runs):
+            work = os.path.join(home, "in")
+            os.mkdir(work)
+            open(os.path.join(work, NAME), "w").close()
+
+            base.append(first_rename([sys.executable, "-c", "pass"],
+                                     work, env))
+            script.append(first_rename([sys.executable, SCRIPT, "-o",
+                                        os.path.join(home, "out")],
+                                       work, env))
+
+            shutil.rmtree(work)
+            shutil.rmtree(os.path.join(home, "out"), True)
+    finally:
+        shutil.rmtree(home)
+
+    base.sort()
+    script.sort()
+    print "{0:>12} {1:>10} {2:>10}".format("", "best ms", "median ms")
+    for label, times in (("interpreter", base), ("fix_nums", script)):
+        print "{0:>12} {1:>10.1f} {2:>10.1f}".format(
+              label, times[0] * 1e3, times[len(times) // 2] * 1e3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Times FileObject creation as the purge list grows.
+
+    python benchmarks/bench_strip.py [files per size]
+
+The per-file cost should stay roughly flat from 30 to 1000 purge terms.
+A third of the terms added are punctuated like "web-dl" or "h.264" rather
+than plain words.
+"""
+import os
+import sys
+import logging
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fix_nums
+
+SIZES = [30, 100, 300, 1000]
+
+NAMES = [
+    "South.Park.S16E05.HDTV.x264-ASAP.mkv",
+    "the_office_us_5x12_Prince_Family_Paper_720p_WEB-DL.mp4",
+    "Doctor Who Season 7 Episode 3 A Town Called Mercy [dd] h.264.avi",
+    "parks.and.recreation.512.hdtv-lol.avi",
+    "Game-of-Thrones-S03E09-The-Rains-of-Castamere-1080p-AAC2.0-CtrlHD.mkv",
+]
+
+
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+    count = int(argv[0]) if argv else 2000
+
+    logging.getLogger().setLevel(logging.WARNING)
+    base = list(fix_nums.STRIP)
+
+    print "{0:>6} {1:>12}".format("terms", "us/file")
+    for size in SIZES:
+        fix_nums.STRIP[:] = base[:size]
+        fix_nums.STRIP.extend(("grp{0:04d}" if i % 3 else "g-{0:04d}.x")
+                              .format(i)
+                              for i in range(size - len(fix_nums.STRIP)))
+
+        names = (NAMES * (count // len(NAMES) + 1))[:count]
+        t = timeit.Timer(lambda: [fix_nums.FileObject(n) for n in names])
+        best = min(t.repeat(3, 1))
+        print "{0:>6} {1:>12.1f}".format(size, best / count * 1e6)
+
+    fix_nums.STRIP[:] = base
+
+
+if __name__ == "__main__":
+    main()
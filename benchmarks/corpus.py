@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Deterministic generator of scene release style filenames.
+
+    python -m benchmarks.corpus [count] [seed]
+
+The same count and seed always give the same names. Names cover each of
+the REGEXS styles, multi-episode releases, terms from STRIP, the usual
+separators and mixed case, plus junk that should not parse at all.
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fix_nums
+
+SHOWS = ["South Park", "The Office US", "Doctor Who", "Parks and Recreation",
+         "Game of Thrones", "Breaking Bad", "Its Always Sunny in Philadelphia",
+         "Mad Men", "Archer", "Community", "The Wire", "Firefly",
+         "Battlestar Galactica", "Arrested Development", "Sherlock",
+         "House of Cards", "Boardwalk Empire", "True Detective", "Fargo",
+         "Brooklyn Nine Nine", "Black Mirror", "The Expanse", "Dark",
+         "Twin Peaks", "Better Call Saul", "Mr Robot", "Rick and Morty"]
+
+TITLES = ["Pilot", "The Rains of Castamere", "A Town Called Mercy",
+          "Prince Family Paper", "Ozymandias", "The Constant", "Remedial Chaos Theory",
+          "Pine Barrens", "Middle Ground", "Out of Gas", "Hush", "Blink",
+          "The Long Night", "Fly", "San Junipero", "Halt and Catch Fire"]
+
+JUNK = ["sample", "readme", "Movie.2010.720p.BluRay", "Extras Featurette",
+        "behind the scenes", "trailer", "CD1", "www.example.org",
+        "Some.Documentary.1080p.WEB-DL", "unknown_file"]
+
+SEPARATORS = [".", " ", "_", "-"]
+
+EXTENSIONS = [".mkv", ".mp4", ".avi", ".mkv", ".mkv", ".mp4"]
+
+
+def _case(rng, s):
+    return rng.choice((s, s.lower(), s.upper(), s.title()))
+
+
+def _episode(rng, season, episode):
+    """ The season and episode part of a name in one of the REGEXS styles,
+        returns (style, text) """
+    style = rng.randrange(9)
+    if style == 0:
+        return "sxxexx", "S{0:02d}E{1:02d}".format(season, episode)
+    if style == 1:
+        return "sxexx", "s{0}e{1:02d}".format(season, episode)
+    if style == 2:
+        return "multi", "S{0:02d}E{1:02d}E{2:02d}".format(season, episode,
+                                                          episode + 1)
+    if style == 3:
+        return "multi", "S{0:02d}E{1:02d}-E{2:02d}".format(season, episode,
+                                                           episode + 1)
+    if style == 4:
+        return "nxnn", rng.choice(("{0}x{1:02d}", "[{0}x{1:02d}]",
+                                   "{0} - {1:02d}", "{0:02d}x{1:02d}"))\
+            .format(season, episode)
+    if style == 5:
+        return "season_episode", "Season {0} Episode {1}".format(season,
+                                                                 episode)
+    if style == 6:
+        return "nnn", "{0}{1:02d}".format(season % 10 or 1, episode)
+    if style == 7:
+        return "multi", "{0}x{1:02d}-{0}x{2:02d}".format(season, episode,
+                                                         episode + 1)
+    return "episode_only", rng.choice(("Ep{0:02d}", "Episode {0}",
+                                       "ep.{0}")).format(episode)
+
+
+def name(rng, strip_terms):
+    """ One release name, returns (style, name) """
+    if rng.random() < 0.05:
+        return "junk", _case(rng, rng.choice(JUNK)) + rng.choice(EXTENSIONS)
+
+    sep = rng.choice(SEPARATORS)
+    style, ep = _episode(rng, rng.randint(1, 12), rng.randint(1, 24))
+    parts = []
+    if style != "episode_only":
+        parts.append(_case(rng, rng.choice(SHOWS)))
+    parts.append(ep)
+    if rng.random() < 0.5:
+        parts.append(_case(rng, rng.choice(TITLES)))
+    for _ in range(rng.randint(0, 4)):
+        parts.append(rng.choice(strip_terms).upper()
+                     if rng.random() < 0.5 else rng.choice(strip_terms))
+    if rng.random() < 0.4:
+        parts[-1] += "-" + rng.choice(strip_terms).upper()
+
+    return style, sep.join(parts).replace(" ", sep) + rng.choice(EXTENSIONS)
+
+
+def generate(count, seed=0):
+    """ List of (style, name) for count names """
+    rng = random.Random(seed)
+    strip_terms = list(fix_nums.STRIP)
+    return [name(rng, strip_terms) for _ in xrange(count)]
+
+
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+    count = int(argv[0]) if argv else 1000
+    seed = int(argv[1]) if len(argv) > 1 else 0
+
+    for style, n in generate(count, seed):
+        print n
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Times the main stages of fix_nums against a generated corpus.
+
+    python -m benchmarks.suite [options]
+
+    --sizes 1000,10000      Corpus sizes, 1k to 1M names
+    --repeat 3              Runs of each benchmark, the best is kept
+    --relocate-max 20000    Most files created for the relocate benchmark
+    --seed 0                Corpus seed
+    --output FILE           Write the results as JSON to FILE, "-" stdout
+    --compare FILE          Compare with earlier JSON results and exit 1
+                            if any benchmark is slower than --threshold
+    --threshold 0.10        Fraction slower that counts as a regression
+
+Benchmarks, each timed per name:
+    parse       FileObject creation, which purges, matches and renders
+    strip       The purge step alone
+    render      Building the new name from already parsed values
+    relocate    Processor moving empty files within a tmpfs tree
+"""
+import getopt
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fix_nums
+from benchmarks import corpus
+
+
+def _best(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        took = time.time() - start
+        if best == None or took < best:
+            best = took
+    return best
+
+
+def _parse(names):
+    return [fix_nums.FileObject(n) for n in names]
+
+
+def bench_parse(names, repeat):
+    return _best(lambda: _parse(names), repeat), len(names)
+
+
+def bench_strip(names, repeat):
+    strip = fix_nums.FileObject(names[0])._FileObject__strip
+    stems = [os.path.splitext(n)[0] for n in names]
+    return _best(lambda: [strip(s) for s in stems], repeat), len(stems)
+
+
+def bench_render(names, repeat):
+    objs = [o for o in _parse(names) if o.new_name]
+    return _best(lambda: [o._create_new_name() for o in objs], repeat), \
+        len(objs)
+
+
+def _tmpfs():
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+def bench_relocate(names, repeat, limit):
+    names = names[:limit]
+    best = None
+    count = 0
+
+    for _ in range(repeat):
+        top = tempfile.mkdtemp(dir=_tmpfs())
+        cwd = os.getcwd()
+        try:
+            os.mkdir(os.path.join(top, "in"))
+            os.chdir(os.path.join(top, "in"))
+            for n in set(names):
+                open(n, "w").close()
+
+            fix_nums.OPTS["OUTPUTDIR"] = os.path.join(top, "out")
+            files = [o for o in _parse(sorted(set(names))) if o.success]
+            count = len(files)
+
+            processor = fix_nums.Processor()
+            start = time.time()
+            processor.process(files)
+            took = time.time() - start
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(top)
+
+        if best == None or took < best:
+            best = took
+
+    return best, count
+
+
+def run(sizes, repeat, relocate_max, seed):
+    results = []
+    for size in sizes:
+        names = [n for _, n in corpus.generate(size, seed)]
+        for bench, func in (("parse", bench_parse), ("strip", bench_strip),
+                            ("render", bench_render)):
+            seconds, items = func(names, repeat)
+            results.append(_result(bench, size, seconds, items))
+
+        seconds, items = bench_relocate(names, repeat, relocate_max)
+        results.append(_result("relocate", size, seconds, items))
+
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "results": results}
+
+
+def _result(bench, size, seconds, items):
+    return {"bench": bench, "size": size, "items": items,
+            "seconds": seconds,
+            "us_per_item": seconds / items * 1e6 if items else None}
+
+
+def compare(old, new, threshold):
+    """ Returns lines comparing per item times and whether any benchmark
+        is more than threshold slower """
+    before = dict(((r["bench"], r["size"]), r) for r in old["results"])
+    lines = []
+    regressed = False
+
+    for r in new["results"]:
+        o = before.get((r["bench"], r["size"]))
+        if not o or not o["us_per_item"] or not r["us_per_item"]:
+            continue
+        change = r["us_per_item"] / o["us_per_item"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "REGRESSION"
+            regressed = True
+        lines.append("{0:<9} {1:>8} {2:>10.2f} {3:>10.2f} {4:>+7.1%} {5}"
+                     .format(r["bench"], r["size"], o["us_per_item"],
+                             r["us_per_item"], change, flag))
+
+    return lines, regressed
+
+
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+
+    opts, args = getopt.getopt(argv, "", ["sizes=", "repeat=", "seed=",
+                                          "relocate-max=", "output=",
+                                          "compare=", "threshold="])
+    sizes = [1000]
+    repeat = 3
+    seed = 0
+    relocate_max = 20000
+    output = None
+    baseline = None
+    threshold = 0.10
+
+    for opt, arg in opts:
+        if opt == "--sizes":
+            sizes = [int(s) for s in arg.split(",")]
+        elif opt == "--repeat":
+            repeat = int(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--relocate-max":
+            relocate_max = int(arg)
+        elif opt == "--output":
+            output = arg
+        elif opt == "--compare":
+            baseline = arg
+        elif opt == "--threshold":
+            threshold = float(arg)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    fix_nums.OPTS["CACHEFILE"] = None
+    fix_nums.OPTS["JOURNAL"] = None
+
+    results = run(sizes, repeat, relocate_max, seed)
+
+    print "{0:<9} {1:>8} {2:>8} {3:>10}".format("bench", "size", "items",
+                                                "us/item")
+    for r in results["results"]:
+        print "{0:<9} {1:>8} {2:>8} {3:>10.2f}".format(
+              r["bench"], r["size"], r["items"], r["us_per_item"] or 0)
+
+    if output == "-":
+        print json.dumps(results, indent=2)
+    elif output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            lines, regressed = compare(json.load(f), results, threshold)
+        print
+        print "{0:<9} {1:>8} {2:>10} {3:>10} {4:>7}".format(
+              "bench", "size", "before", "after", "change")
+        for line in lines:
+            print line
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Telling whether two files hold the same content without reading them.
+
+Files of different sizes are never the same. Files of the same size are
+compared on a hash of a block from the head, middle and tail, and only
+when those agree is the whole of each file hashed. Hashes are cached by
+device, inode, size and mtime so a library file is hashed at most once
+however many runs compare against it.
+"""
+
+import hashlib
+import os
+import sqlite3
+import stat
+import threading
+
+BLOCK = 64 * 1024
+
+
+def sample_hash(path, size, block=BLOCK):
+    """ Hash of the size and the head, middle and tail blocks of path, the
+        whole file for files of three blocks or less """
+    h = hashlib.sha1(str(size))
+    with open(path, "rb") as f:
+        if size <= 3 * block:
+            h.update(f.read())
+        else:
+            for offset in (0, size // 2 - block // 2, size - block):
+                f.seek(offset)
+                h.update(f.read(block))
+    return h.hexdigest()
+
+
+def same_file(a, b):
+    """ True if a and b are the same file on disk, hard links included,
+        False if not or if either cannot be looked at """
+    try:
+        sa, sb = os.lstat(a), os.lstat(b)
+    except OSError:
+        return False
+    return (sa.st_dev, sa.st_ino) == (sb.st_dev, sb.st_ino)
+
+
+def full_hash(path, chunk=1024 * 1024):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+class HashCache:
+    """ SQLite store of hashes keyed by (device, inode, size, mtime) """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+                               dev INTEGER, inode INTEGER, size INTEGER,
+                               mtime REAL, kind TEXT, digest TEXT,
+                               PRIMARY KEY (dev, inode, size, mtime, kind))""")
+        self.db.commit()
+
+    def get(self, st, kind):
+        with self.lock:
+            row = self.db.execute("""SELECT digest FROM hashes WHERE
+                                     dev = ? AND inode = ? AND size = ? AND
+                                     mtime = ? AND kind = ?""",
+                                  (st.st_dev, st.st_ino, st.st_size,
+                                   st.st_mtime, kind)).fetchone()
+        return row and str(row[0])
+
+    def put(self, st, kind, digest):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO hashes VALUES "
+                            "(?, ?, ?, ?, ?, ?)",
+                            (st.st_dev, st.st_ino, st.st_size, st.st_mtime,
+                             kind, digest))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class DuplicateFinder:
+    """
+    Compares files by size, then sampled hash, then full hash. Hashes are
+    kept in memory for the run and in cache, a HashCache, when given.
+    """
+
+    def __init__(self, cache=None, block=BLOCK):
+        self.cache = cache
+        self.block = block
+        self._hashes = {}
+        self.hashed = 0
+
+    def _hash(self, path, st, kind):
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime, kind)
+        if key in self._hashes:
+            return self._hashes[key]
+
+        digest = self.cache.get(st, kind) if self.cache else None
+        if not digest:
+            if kind == "sample":
+                digest = sample_hash(path, st.st_size, self.block)
+            else:
+                digest = full_hash(path)
+            self.hashed += 1
+            if self.cache:
+                self.cache.put(st, kind, digest)
+
+        self._hashes[key] = digest
+        return digest
+
+    def same(self, a, b):
+        """ True if a and b are two files with the same content. False if
+            not, if either cannot be read, if either is a symbolic link or
+            if they are one and the same file, which is no duplicate """
+        try:
+            sa, sb = os.lstat(a), os.lstat(b)
+            if stat.S_ISLNK(sa.st_mode) or stat.S_ISLNK(sb.st_mode):
+                return False
+            if (sa.st_dev, sa.st_ino) == (sb.st_dev, sb.st_ino):
+                return False
+            if sa.st_size != sb.st_size:
+                return False
+
+            if self._hash(a, sa, "sample") != self._hash(b, sb, "sample"):
+                return False
+            # Files no bigger than the samples were hashed whole already
+            if sa.st_size <= 3 * self.block:
+                return True
+            return self._hash(a, sa, "full") == self._hash(b, sb, "full")
+        except (IOError, OSError):
+            return False
+
+    def close(self):
+        if self.cache:
+            self.cache.close()
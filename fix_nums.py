@@ -62,6 +62,68 @@ OPTIONS
         and copied to the specified location with
         thier new names.
 
+    --link [hard|sym|reflink]
+        Instead of moving or copying the files
+        a hardlink, symlink or reflink (a copy on
+        write clone on btrfs and XFS) is created
+        at the new name. The original is left
+        untouched and no data is copied. Files
+        that cannot be linked, such as those on
+        a different device, are copied instead.
+
+    --subs [directory]
+        Put subtitles in this subdirectory of
+        the episode's directory, I.E. "subs".
+        Default is next to the episode.
+
+    --no-sidecars
+        Subtitles, .nfo files and artwork named
+        after an episode are normally renamed
+        and moved along with it. This turns
+        that off, subtitles are then renamed
+        on their own and the rest left alone.
+
+    --correct
+        Correct misspelled show names against
+        the shows already known, I.E. 'suth park'
+        becomes 'south park'. Known shows are
+        kept in SHOWDB, along with the
+        directories in the output directory, and
+        added to as files are renamed.
+
+    --similarity [number]
+        How alike, between 0 and 1, a show name
+        has to be to a known show to be
+        corrected. Default is 0.7.
+
+    --lookup [provider]
+        Look up episode names online for
+        {episode_name} instead of using what is
+        left of the filename. Each show is only
+        looked up once per batch and results
+        are cached for TITLETTL seconds.
+        Providers: tvmaze
+
+    --lookup-url [url]
+        Base URL to send --lookup requests to,
+        for a mirror or a local stand-in.
+        Default is the provider's own.
+
+    --no-cache
+        Parse every file again instead of using
+        the results stored in CACHEFILE by
+        earlier runs.
+
+    --no-manifest
+        Look at every file again. Normally files
+        an earlier run left where they were,
+        because they could not be renamed or
+        were copied, are passed over and
+        directories where nothing has changed
+        are not searched. The record is kept in
+        MANIFEST. Not used for dry runs, plans
+        or --watch.
+
     -s, --strict
         This option enables a strict renaming
         procedure. Files are not processed if
@@ -93,6 +155,134 @@ OPTIONS
     -x, --dryrun
         Performs a dryrun of any selected operations.
 
+    --plan [file]
+        Instead of renaming anything write what
+        would be done to file, one line per
+        file, so it can be checked and applied
+        later with --apply. Lines are tab
+        separated: action, source, destination
+        and the reason for any skipped file.
+
+    --journal [file]
+        Where to record every relocation so it
+        can be reverted. Default is
+        "$HOME/.fix_nums.journal", "NONE" turns
+        the journal off. The original path is
+        also stored in the user.fix_nums.origin
+        extended attribute of each new file.
+
+    --journal-keep [number]
+        How many runs the journal keeps, older
+        ones are dropped as each run ends so it
+        does not grow for ever. 0 keeps every
+        run. Default is 20.
+
+    --revert [last|all|run]
+        Undo the relocations recorded in the
+        journal for the last run, every run, or
+        the run with the given id, newest first.
+        Runs interrupted part way through are
+        rolled back as far as they got.
+        Uses -j workers per device pair, 4 if
+        it is not given.
+
+    --processes [number]
+        Parse names on this many processes,
+        worthwhile for many thousands of files.
+        Files are still renamed in the order
+        they were found.
+
+    --duplicates [skip|remove]
+        When a file already exists at the new
+        name check whether it holds the same
+        content, comparing size, then a hash of
+        the start, middle and end and only then
+        the whole file. Identical files are
+        skipped, or with "remove" deleted when
+        they would have been moved. Hashes are
+        kept in HASHCACHE.
+
+    --stats
+        Report where the time went at the end of
+        the run: time in each phase, files and
+        MB per second, how often each pattern
+        was tried and matched and counts of
+        filesystem calls. Phases on different
+        threads overlap, their times can add up
+        to more than the wall time.
+        With -x files are counted as planned
+        rather than relocated.
+
+    --stats-json [file]
+        As --stats and also write the figures
+        to file as JSON.
+
+    --profile [file]
+        Run under cProfile and write the
+        profile to file, for use with pstats.
+
+    --apply [file]
+        Carry out a plan written by --plan
+        without searching for or parsing any
+        files. Destinations are checked again
+        before each file is relocated.
+
+    -j, --jobs [number]
+        Relocate files in parallel using this
+        many workers for each pair of source and
+        destination devices. Transfers between
+        different devices run at the same time.
+        A summary of throughput for each device
+        is shown at the end.
+
+    -R, --recursive
+        Search directories for video files
+        recursively. Directories given on the
+        command line are searched as well as
+        the current directory.
+
+    --watch [directory]
+        Stay running and rename media files as
+        they arrive in this directory. Files are
+        handled once their size stops changing
+        and arrivals close together are handled
+        as one batch. Combine with -R to watch
+        the directories inside it as well.
+
+    --queue [number]
+        Scanning, parsing and relocating run side
+        by side, each of the first two on its
+        own thread and able to get this many
+        files ahead of the next. Parsing is
+        spread further with --processes and
+        relocation with --jobs. 0 runs them in
+        turn. Default is 1000.
+
+    --serve
+        Stay running and rename the jobs sent by
+        service.py, a client taking the same
+        options and files as this script, for
+        download client hooks to call instead.
+        Jobs start from the options given here.
+        Jobs with the same options from the same
+        directory that arrive together are
+        renamed as one batch.
+
+    --socket [path]
+        The Unix domain socket --serve listens on
+        and service.py connects to. Default is
+        ~/.fix_nums.sock.
+
+    --maxdepth [number]
+        Limits how many directories deep a
+        recursive search will go. 0 only looks
+        at the directory itself.
+
+    --exclude [glob]
+        Files and directories matching this
+        glob are skipped while searching.
+        This option can be added multiple times.
+
     -h, --help
         Display this help message
 
@@ -142,13 +332,38 @@ FORMAT OPTIONS
 """
 
 import getopt
+import fnmatch
+import hashlib
+import itertools
 import os
 import sys
 import re
+import time
 import shutil
+import sqlite3
+import stat
 import logging
 from string import capwords
 from ColorizedFormatter import ColorizedFormatter
+import relocate
+from relocate import DestinationIndex, RelocationScheduler
+from parsecache import ParseCache
+from watch import Watcher
+from showindex import ShowIndex
+import journal
+from stats import Stats
+from dupes import DuplicateFinder, HashCache, same_file
+from manifest import Manifest
+from pipeline import Stage
+# metadata is imported when --lookup is used, httplib is slow to load
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 license = """
 LICENSE
@@ -232,6 +447,80 @@ OPTS = {
 #
 "MEDIAFORMATS" : [".mkv",".mp4",".avi",".flv",".mpg",".mpeg",".srt"],
 # Holds the extensions of common media files to include
+"SUBFORMATS" : [".srt",".sub",".idx",".ass",".ssa",".vtt"],
+# Subtitle extensions, these move with the episode they are named after
+"SIDECARFORMATS" : [".nfo",".jpg",".png",".tbn"],
+# Other extensions that move with the episode they are named after
+"SIDECARS" : True,
+# Move subtitles and other sidecar files along with their episode
+"SUBSDIR" : None,
+# Subdirectory of the episode's directory for subtitles, None for none
+"RECURSIVE" : False,
+# Search directories recursively for media files
+"MAXDEPTH" : None,
+# How deep a recursive search can go, None for no limit
+"EXCLUDE" : [],
+# Globs of file or directory names to skip while searching
+"SKIPDIRS" : ["incomplete", "_unpack_*", "_failed_*", "*.partial"],
+# Directories that hold partial downloads, matched in lower case
+"LINKMODE" : None,
+# Link to the original instead of moving - "hard", "sym" or "reflink"
+"CACHEFILE" : os.path.expanduser("~/.fix_nums.db"),
+# SQLite cache of parse results, None disables it
+"CACHESIZE" : 200000,
+# Most entries kept in the cache
+"WATCH" : None,
+# Directory to watch for new files, None runs once and exits
+"SETTLE" : 5.0,
+# Seconds a watched file's size must stay the same before it is renamed
+"DEBOUNCE" : 2.0,
+# Seconds to wait for more files before renaming a watched batch
+"CORRECT" : False,
+# Correct show names to the closest known show
+"SIMILARITY" : 0.7,
+# How alike a show name must be to a known show to be corrected
+"SHOWDB" : os.path.expanduser("~/.fix_nums.db"),
+# SQLite database holding the known shows
+"LOOKUP" : None,
+# Provider to look episode names up with, None uses the filename
+"LOOKUPURL" : None,
+# Base URL for the provider, None uses its default
+"TITLECACHE" : os.path.expanduser("~/.fix_nums.db"),
+# SQLite cache of looked up episode names
+"TITLETTL" : 7 * 86400,
+# Seconds before looked up episode names are fetched again
+"PLAN" : None,
+# File to write planned relocations to instead of carrying them out
+"APPLY" : None,
+# Plan file to carry out instead of searching for files
+"JOURNAL" : os.path.expanduser("~/.fix_nums.journal"),
+# Append only record of relocations used by --revert, None disables it
+"JOURNALKEEP" : 20,
+# Runs kept in the journal, older ones are dropped as a run ends, 0 keeps all
+"REVERT" : None,
+# Run to revert - "last", "all" or a run id from the journal
+"STATS" : False,
+# Report time per phase and counts at the end of the run
+"STATSJSON" : None,
+# File to write the --stats figures to as JSON
+"PROFILE" : None,
+# File to write a cProfile profile of the run to
+"PROCESSES" : 0,
+# Processes to parse names with, 0 parses in this process
+"DUPLICATES" : None,
+# What to do when a destination holds the same content - "skip" or "remove"
+"HASHCACHE" : os.path.expanduser("~/.fix_nums.db"),
+# SQLite cache of file hashes used to find duplicates
+"QUEUE" : 1000,
+# Files each of the scan and parse stages can get ahead by, 0 runs them in turn
+"SERVE" : False,
+# Stay running and rename jobs sent by service.py clients
+"SOCKET" : os.path.expanduser("~/.fix_nums.sock"),
+# Unix domain socket the service listens on
+"MANIFEST" : os.path.expanduser("~/.fix_nums.db"),
+# SQLite record of what earlier runs left alone, None disables it
+"JOBS" : 0,
+# Workers per source/destination device pair, 0 relocates serially
 }
 ###########################################################
 
@@ -256,6 +545,20 @@ STRIP = [ "hdtv", "xvid", "lol", "fqm", "320p",
 # Arguements are in lower case
 ###############
 
+# Compiled purge list, rebuilt whenever STRIP is changed
+_STRIP_CACHE = {"terms": None, "passes": ()}
+_WORD_RE = re.compile("\w+")
+_PLAIN_TERM_RE = re.compile("\w+\Z")
+
+# Known shows, loaded the first time a name is corrected in a library
+_SHOW_INDEX = {"key": None, "index": None}
+
+# Compiled write format, rebuilt whenever the options it uses change
+_RENDERER_CACHE = {"key": None, "renderer": None}
+_FIELD_RE = re.compile("\{(\w+)\}")
+_DOTS_RE = re.compile("\.{2,}")
+_TITLE_RE = re.compile("[^\w&!]+", re.UNICODE)
+
 ### Regexs ###################################
 REGEXS = [
     re.compile("""  
@@ -312,59 +615,385 @@ REGEXS = [
     ,re.IGNORECASE | re.VERBOSE),
 ]
 
+# Cheap tests a name has to pass for the REGEXS entry at the same index to
+# have any chance of matching. None means always try the pattern.
+REGEX_FILTERS = [
+    re.compile("s\d", re.IGNORECASE),
+    re.compile("\d\ ?[-x]\ ?\d", re.IGNORECASE),
+    re.compile("season.*episode", re.IGNORECASE),
+    re.compile("[\W_]\d{3}[\W_]"),
+    re.compile("ep", re.IGNORECASE),
+]
+##############################################
+
+# Combined form of REGEXS, rebuilt whenever REGEXS is changed
+_MATCHER_CACHE = {"patterns": None, "matcher": None}
+_GROUP_RE = re.compile("\(\?P<(\w+)>")
+_COND_RE = re.compile("\(\?\((\w+)\)")
+
+def _alternation(terms):
+    """ Regex matching any of terms, tried longest first. Terms starting
+        with a literal character are grouped under it so a name is only
+        tried against the terms starting with the character it has """
+    by_first = {}
+    rest = []
+    for t in sorted(terms, key=lambda t: (-len(t), t)):
+        if t[0].isalnum():
+            by_first.setdefault(t[0], []).append(t[1:])
+        else:
+            rest.append(t)
+    
+    alternatives = rest + [first + "(?:" + "|".join(tails) + ")"
+                           for first, tails in sorted(by_first.items())]
+    return "|".join(alternatives)
+
+
+def _strip_pass(words, terms):
+    # One pass over the name whatever the number of terms. At each place a
+    # punctuated term (a regex, like "h.264") is tried first, then the
+    # whole word is looked up in the set of plain terms.
+    if terms:
+        p = re.compile("(?P<term>\\b(?:" + _alternation(terms) +
+                       ")\\b)|\\w+")
+    else:
+        p = _WORD_RE
+    
+    def repl(m):
+        if m.group("term") != None or m.group() in words:
+            return ""
+        return m.group()
+    
+    def strip_terms(s):
+        return p.sub(repl, s)
+    
+    return strip_terms
+
+
+def _compile_strip(terms):
+    """ Turns the purge list into a single substitution pass.
+        
+        Plain word terms are looked up in a set, anything containing
+        other characters goes into one alternation, longest first. Unlike
+        substituting each term in turn, text brought together by removing
+        a term is not looked at again."""
+    if not terms:
+        return ()
+    
+    words = set(t for t in terms if _PLAIN_TERM_RE.match(t))
+    return (_strip_pass(words, [t for t in terms if t not in words]),)
+
+
+def strip_passes():
+    if _STRIP_CACHE["terms"] != STRIP:
+        _STRIP_CACHE["passes"] = _compile_strip(STRIP)
+        _STRIP_CACHE["terms"] = list(STRIP)
+    
+    return _STRIP_CACHE["passes"]
+
+
+class EpisodeMatcher: 
+    """ Matches names against a list of patterns in a single call while
+        keeping the precedence of trying each pattern in turn.
+        
+        Every pattern is wrapped as ".*?(?:pattern)" and joined into one
+        alternation that is anchored at the start of the name, so the
+        leftmost match of an earlier pattern always wins, just like
+        searching with each one separately. Names are first put through
+        the filters so patterns that cannot match are left out of the
+        alternation altogether.
+        
+        Counts of names seen, which pattern won and time spent on names
+        that matched nothing are kept in names, won, skipped, failed and
+        fail_time."""
+    
+    def __init__(self, patterns, filters=()):
+        self.patterns = list(patterns)
+        self.filters = list(filters) + [None] * len(self.patterns)
+        self.names = 0
+        self.won = [0] * len(self.patterns)
+        self.skipped = [0] * len(self.patterns)
+        self.failed = 0
+        self.fail_time = 0.0
+        self._combined = {}
+        self._groups = []
+        
+        for i, p in enumerate(self.patterns):
+            self._groups.append([(g, "{0}__{1}".format(g, i))
+                                 for g in sorted(p.groupindex)])
+        
+        flags = set(p.flags for p in self.patterns)
+        self._flags = flags.pop() if len(flags) == 1 else None
+    
+
+    def _compile(self, which):
+        parts = []
+        for i in which:
+            src = self.patterns[i].pattern
+            src = _GROUP_RE.sub("(?P<\\1__{0}>".format(i), src)
+            src = _COND_RE.sub("(?(\\1__{0})".format(i), src)
+            # The newline ends any trailing comment in verbose patterns
+            parts.append("(?P<_{0}>.*?(?:{1}\n))".format(i, src))
+        
+        return re.compile("|".join(parts), self._flags)
+    
+
+    def match(self, name):
+        """ Returns (index, groupdict) for the first pattern to match name
+            or None. The groupdict has the same keys as the pattern's."""
+        start = time.time()
+        self.names += 1
+        which = []
+        for i, f in enumerate(self.filters[:len(self.patterns)]):
+            if f == None or f.search(name):
+                which.append(i)
+            else:
+                self.skipped[i] += 1
+        
+        m = None
+        if which and self._flags != None:
+            which = tuple(which)
+            if which not in self._combined:
+                self._combined[which] = self._compile(which)
+            m = self._combined[which].match(name)
+        elif which:
+            # Patterns with different flags cannot share a regex
+            for i in which:
+                sm = self.patterns[i].search(name)
+                if sm:
+                    self.won[i] += 1
+                    return i, sm.groupdict()
+        
+        if not m:
+            self.failed += 1
+            self.fail_time += time.time() - start
+            return None
+        
+        i = int(m.lastgroup[1:])
+        self.won[i] += 1
+        return i, dict((g, m.group(n)) for g, n in self._groups[i])
+    
+
+    def stats(self):
+        """ Lines describing how often each pattern was used """
+        lines = []
+        for i in range(len(self.patterns)):
+            lines.append("Pattern {0} | matched {1}, skipped {2}".format(
+                         i, self.won[i], self.skipped[i]))
+        lines.append("No match | {0} names, {1:.3f}s".format(
+                     self.failed, self.fail_time))
+        
+        return lines
+    
+
+    def counts(self):
+        """ [{"pattern", "tried", "matched", "skipped"}] for each pattern,
+            tried counting names not ruled out by the pattern's filter """
+        return [{"pattern": i, "tried": self.names - self.skipped[i],
+                 "matched": self.won[i], "skipped": self.skipped[i]}
+                for i in range(len(self.patterns))]
+    
+
+    def take_counts(self):
+        """ Returns the counts kept so far, for add_counts(), and starts
+            them again from nothing """
+        counts = (self.names, self.won, self.skipped, self.failed,
+                  self.fail_time)
+        self.names = self.failed = 0
+        self.fail_time = 0.0
+        self.won = [0] * len(self.patterns)
+        self.skipped = [0] * len(self.patterns)
+        return counts
+    
+
+    def add_counts(self, counts):
+        """ Adds counts from take_counts() on another matcher, such as one
+            in a parse worker """
+        names, won, skipped, failed, fail_time = counts
+        self.names += names
+        self.failed += failed
+        self.fail_time += fail_time
+        for i in range(len(self.patterns)):
+            self.won[i] += won[i]
+            self.skipped[i] += skipped[i]
+
+
+# Stats for the run when --stats is given, None otherwise
+STATS = None
+
+def _phase(name):
+    """ Decorator charging the time spent in a function to a --stats phase """
+    def decorator(func):
+        def timed(*args, **kwargs):
+            if not STATS:
+                return func(*args, **kwargs)
+            STATS.start(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STATS.stop()
+        timed.__name__ = func.__name__
+        timed.__doc__ = func.__doc__
+        return timed
+    return decorator
+
+
+def episode_matcher():
+    if _MATCHER_CACHE["patterns"] != REGEXS:
+        _MATCHER_CACHE["matcher"] = EpisodeMatcher(REGEXS, REGEX_FILTERS)
+        _MATCHER_CACHE["patterns"] = list(REGEXS)
+    
+    return _MATCHER_CACHE["matcher"]
+
+
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
 _STDOUT_LOGGER = logging.StreamHandler(sys.stdout)
 _STDOUT_LOGGER_FORMAT = logging.Formatter("%(message)s")
-_COLOR_FORMATTER = ColorizedFormatter(formatter=_STDOUT_LOGGER_FORMAT)
-_COLOR_FORMATTER.colorize_level(logging.INFO, "dk_green")
-_COLOR_FORMATTER.colorize_level(logging.DEBUG, "purple")
-_STDOUT_LOGGER.setFormatter(_COLOR_FORMATTER)
-#_STDOUT_LOGGER.setFormatter(_STDOUT_LOGGER_FORMAT)
+_STDOUT_LOGGER.setFormatter(_STDOUT_LOGGER_FORMAT)
 
 LOGGER.addHandler(_STDOUT_LOGGER)
 
+
+def colorize_output():
+    """ Colors messages written to stdout, called from main() only when
+        stdout is a terminal as setting up the colors is not free """
+    formatter = ColorizedFormatter(formatter=_STDOUT_LOGGER_FORMAT)
+    formatter.colorize_level(logging.INFO, "dk_green")
+    formatter.colorize_level(logging.DEBUG, "purple")
+    _STDOUT_LOGGER.setFormatter(formatter)
+
 #################
 
-class FileObject: 
-    """ Class for representing info about a file"""
-    
-    def __init__(self, start_name): 
-        self.values = { "old_name"      : None,
-                        "start_name"    : start_name,
-                        "directory"     : None,
-                        "extension"     : None,
-                        "show_name"     : None,
-                        "episode"       : None,
-                        "season"        : None,
-                        "new_name"      : None,
-                        "episode_name"  : None }
+class NameRenderer: 
+    """ The parts of OPTS used to build a new name, compiled once so
+        they can be shared by every FileObject in a run.
         
-        LOGGER.debug("Created fileobject for %s", start_name)
-        self.success = True
-        self._split_start_name(start_name)
-        self._parse()
+        Use name_renderer() to get one matching the current OPTS."""
+    
+    def __init__(self, writeformat, delim, camelcase, strict, spad, epad):
+        self.writeformat = writeformat
+        self.delim = delim
+        self.camelcase = camelcase
+        self.strict = strict
+        self.spad = spad
+        self.epad = epad
+        self.fields = tuple(_FIELD_RE.findall(writeformat))
     
 
-    def __is_strict(self, f_args): 
-        p = re.compile("\{(\w+)\}")
-        o = p.findall(OPTS["WRITEFORMAT"])
-        
-        for a in o:
+    def capitalize(self, s):
+        if self.camelcase:
+            return capwords(s).replace(" ", self.delim)
+        else:
+            return s.replace(" ", self.delim)
+    
+
+    def pad(self, n, pad_count):
+        return str(n).rjust(pad_count, "0")
+    
+
+    def is_strict(self, f_args): 
+        for a in self.fields:
             if f_args[a] == None or f_args[a] == "":
                 return False
         
         return True
     
 
+    def render(self, f_args, extension): 
+        s = self.writeformat.format(**f_args)
+        LOGGER.debug("create_new_name : %s", s)
+        s = s.strip()
+        s = s.replace(" ", self.delim)
+        s = _DOTS_RE.sub(".", s)
+        
+        final_name = s + extension
+        LOGGER.debug("create_new_name - finished: %s", final_name)
+        return final_name
+
+
+def show_index():
+    """ The index of known shows in SHOWDB, with the directories in
+        OPTS["OUTPUTDIR"] added. Reopened when either changes, as
+        between service batches with different options."""
+    key = (OPTS["SHOWDB"], os.path.abspath(OPTS["OUTPUTDIR"]))
+    if _SHOW_INDEX["key"] != key:
+        close_show_index()
+        try:
+            index = ShowIndex(OPTS["SHOWDB"])
+        except sqlite3.Error, e:
+            LOGGER.info("Cannot open {0} - {1}".format(OPTS["SHOWDB"], e))
+            index = ShowIndex()
+        
+        index.add_dir(OPTS["OUTPUTDIR"], OPTS["DELIM"])
+        _SHOW_INDEX["key"] = key
+        _SHOW_INDEX["index"] = index
+    
+    return _SHOW_INDEX["index"]
+
+
+def close_show_index():
+    if _SHOW_INDEX["index"] != None:
+        _SHOW_INDEX["index"].close()
+    _SHOW_INDEX["key"] = None
+    _SHOW_INDEX["index"] = None
+
+
+def name_renderer():
+    key = (OPTS["WRITEFORMAT"], OPTS["DELIM"], OPTS["CAMALCASE"],
+           OPTS["STRICT"], OPTS["SPAD"], OPTS["EPAD"])
+    
+    if _RENDERER_CACHE["key"] != key:
+        _RENDERER_CACHE["renderer"] = NameRenderer(*key)
+        _RENDERER_CACHE["key"] = key
+    
+    return _RENDERER_CACHE["renderer"]
+
+
+class FileObject(object): 
+    """ Class for representing info about a file.
+        
+        Slotted rather than holding a dict of values as a run can pass
+        through millions of them."""
+    
+    __slots__ = ("renderer", "entry", "sidecars", "success",
+                 "old_name", "start_name", "directory", "extension",
+                 "show_name", "episode", "season", "new_name",
+                 "episode_name")
+    
+    def __init__(self, start_name, renderer=None, entry=None, cached=None,
+                 correct=True): 
+        self.renderer = renderer or name_renderer()
+        self.entry = entry
+        # (path, entry, tag) of files to move along with this one
+        self.sidecars = ()
+        self.start_name = start_name
+        self.show_name = self.episode = self.season = None
+        self.new_name = self.episode_name = None
+        
+        LOGGER.debug("Created fileobject for %s", start_name)
+        self.success = True
+        self._split_start_name(start_name)
+        
+        # cached is a (parsed(), success) pair from an earlier parse
+        if cached:
+            (self.show_name, self.season, self.episode, self.episode_name,
+             self.new_name) = cached[0]
+            self.success = cached[1]
+        else:
+            self._parse()
+        
+        if correct:
+            self.correct()
+    
+
     def __strip(self, s):
         s = s.lower()
         LOGGER.debug("Starting __strip : '%s'", s)
         s = s.replace("_", " ")
         
-        for i in STRIP:
-            s = re.compile("\\b" + i + "\\b").sub("", s)
+        for p in strip_passes():
+            s = p(s)
         
         LOGGER.debug("Strip : Result : '%s'", s)
         
@@ -381,19 +1010,6 @@ class FileObject:
         return s
     
 
-    def __capitalize(self, s):
-        if OPTS["CAMALCASE"]:
-            return capwords(s).replace(" ", OPTS["DELIM"])
-        else:
-            return s.replace(" ", OPTS["DELIM"])
-    
-    def __pad(self, n, pad_count):
-        s = str(n)
-        while len(s) < pad_count:
-            s = "0" + s
-            
-        return s
-    
     def _parse(self):
         self._season_episode_parse()
         self._create_new_name()
@@ -403,120 +1019,259 @@ class FileObject:
         d, f = os.path.split(fname)
         f, e = os.path.splitext(f)
 
-        self.values["directory"] = d
-        self.values["old_name"]  = f
-        self.values["extension"] = e
+        self.directory = d
+        self.old_name  = f
+        self.extension = e
     
 
     def _season_episode_parse(self): 
-        """ Performs multiple searchs to determine
+        """ Matches the name against REGEXS to determine
             the season and episode numbers. 
             
             Uses discovered values or values passed in via options to
             asgn values to the fileObject"""
         
-        for p in REGEXS:
-            LOGGER.debug("Trying to match with regexp: %s", p)
-            m = re.search(p, self.values["old_name"])
+        m = episode_matcher().match(self.old_name)
+        
+        if m:
+            season = episode = showname = episodename = None
+            values = m[1]
+            LOGGER.debug("Matched pattern %d - Parsed Values : %s", m[0], values)
             
-            if m:
-                season = episode = showname = episodename = None
-                values = m.groupdict()
-                LOGGER.debug("Matched - Parsed Values : %s", values)
+            if "E" in values:
+                episode = int(values["E"])
+            else:
+                self.success = False
                 
-                if "E" in values:
-                    episode = int(values["E"])
+            if "S" in values:
+                if OPTS["SEASON"]:
+                    season = OPTS["SEASON"]
                 else:
-                    self.success = False
-                    
-                if "S" in values:
-                    if OPTS["SEASON"]:
-                        season = OPTS["SEASON"]
-                    else:
-                        season = int(values["S"])
+                    season = int(values["S"])
+            else:
+                if OPTS["SEASON"]:
+                    season = OPTS["SEASON"]
                 else:
-                    if OPTS["SEASON"]:
-                        season = OPTS["SEASON"]
-                    else:
-                        self.success = False
-                
-                
-                if "SN" in values:
-                    if OPTS["SHOWNAME"]:
-                        showname = OPTS["SHOWNAME"]
-                    else:
-                        showname = values["SN"]
+                    self.success = False
+            
+            
+            if "SN" in values:
+                if OPTS["SHOWNAME"]:
+                    showname = OPTS["SHOWNAME"]
                 else:
-                    if OPTS["SHOWNAME"]:
-                        showname = OPTS["SHOWNAME"]
-                    else:
-                        self.success = False
-                
-                if "EN" in values:
-                    episodename = values["EN"]
+                    showname = values["SN"]
+            else:
+                if OPTS["SHOWNAME"]:
+                    showname = OPTS["SHOWNAME"]
                 else:
-                    episodename = ""
-                
-                self.values["season"] = self.__pad(season, OPTS["SPAD"])
-                self.values["episode"] = self.__pad(episode, OPTS["EPAD"])
-                self.values["show_name"] = self.__capitalize(self.__strip(showname.strip()))
-                self.values["episode_name"] = self.__capitalize(self.__strip(episodename.strip()))
-                return
+                    showname = ""
+                    self.success = False
+            
+            if "EN" in values:
+                episodename = values["EN"]
+            else:
+                episodename = ""
+            
+            showname = self.__strip(showname.strip())
+            
+            r = self.renderer
+            self.season = r.pad(season, r.spad)
+            self.episode = r.pad(episode, r.epad)
+            self.show_name = r.capitalize(showname)
+            self.episode_name = r.capitalize(self.__strip(episodename.strip()))
+            return
         
         self.success = False
     
     
+    def correct(self): 
+        """ Replaces the show name with the closest known show for
+            --correct and renders the new name again. Parses are cached
+            before this, so a new show does not invalidate them. """
+        if not OPTS["CORRECT"] or OPTS["SHOWNAME"] or not self.show_name:
+            return
+        
+        name = self.show_name
+        if OPTS["DELIM"]:
+            name = name.replace(OPTS["DELIM"], " ")
+        m = show_index().lookup(name, OPTS["SIMILARITY"])
+        if not m:
+            return
+        
+        showname = self.renderer.capitalize(m[0])
+        if showname != self.show_name:
+            LOGGER.debug("Corrected show name '%s' to '%s' (%.2f)",
+                         self.show_name, showname, m[1])
+            self.show_name = showname
+            self._create_new_name()
+    
+
+    @_phase("render")
     def _create_new_name(self): 
-        format_args = { "episode"       : self.values["episode"],
-                        "season"        : self.values["season"],
-                        "show_name"     : self.values["show_name"],
-                        "episode_name"  : self.values["episode_name"],
+        format_args = { "episode"       : self.episode,
+                        "season"        : self.season,
+                        "show_name"     : self.show_name,
+                        "episode_name"  : self.episode_name,
                         "sep"           : os.sep }
         
-        if OPTS["STRICT"] and not self.__is_strict(format_args):
+        if self.renderer.strict and not self.renderer.is_strict(format_args):
             self.success = False
             return
         
-        s = OPTS["WRITEFORMAT"].format(**format_args)
-        LOGGER.debug("create_new_name : %s", s)
-        s = s.strip()
-        s = s.replace(" ", OPTS["DELIM"])
-        s = re.compile("\.{2,}").sub(".", s)
-        
-        final_name = s + self.values["extension"]
-        LOGGER.debug("create_new_name - finished: %s", final_name)
-        self.values["new_name"] = final_name
+        self.new_name = self.renderer.render(format_args, self.extension)
+    
+
+    def stat(self):
+        # Reuses the stat taken while scanning when there is one
+        if self.entry:
+            return self.entry.stat()
+        if STATS:
+            STATS.count("stat")
+        return os.stat(self.start_name)
+    
+
+    def set_episode_name(self, title):
+        # Titles can hold anything, keep only what is safe in a filename
+        if not isinstance(title, unicode):
+            title = title.decode("utf-8", "replace")
+        title = _TITLE_RE.sub(" ", title.lower().replace("'", ""))
+        title = " ".join(title.split()).encode("utf-8")
+        self.episode_name = self.renderer.capitalize(title)
+        self._create_new_name()
+    
+
+    def parsed(self):
+        """ The ParseCache.FIELDS of this file as a tuple """
+        return (self.show_name, self.season, self.episode, self.episode_name,
+                self.new_name)
     
 
     def get(self):
         if self.success == True:
-            return (self.values["start_name"], self.values["new_name"])
+            return (self.start_name, self.new_name)
         else:
-            return (self.values["start_name"], False)
+            return (self.start_name, False)
     
     
+# Action name and link function for each of the --link modes
+LINKMODES = { "hard"    : ("Hardlink", relocate.hardlink),
+              "sym"     : ("Symlink", relocate.symlink),
+              "reflink" : ("Reflink", relocate.reflink) }
+
+
+def write_plan(f, action, src, dst, reason=""):
+    # Fields are escaped so tabs and newlines in names cannot break lines
+    f.write("\t".join(x.encode("string_escape")
+                      for x in (action, src, dst or "", reason)) + "\n")
+
+
+def read_plan(f):
+    """ Generator of (action, source, destination, reason) from a plan """
+    for line in f:
+        if line.startswith("#") or not line.strip():
+            continue
+        yield tuple(x.decode("string_escape")
+                    for x in line.rstrip("\n").split("\t"))
+
+
 class Processor: 
-    def __init__(self):
+    def __init__(self, plan=None, journal=None, duplicates=None,
+                 manifest=None, results=None):
         self.files = []
+        # Open plan file to write decisions to instead of acting on them
+        self.plan = plan
+        self.journal = journal
+        # DuplicateFinder to check existing destinations with
+        self.duplicates = duplicates
+        # Manifest to record the outcome of files left in place in
+        self.manifest = manifest
+        # List to add (action, source, destination, outcome) to for each file
+        self.results = results
         
-        if OPTS["SAFERENAME"]:
+        # Copies, including moves between devices, can resume if interrupted
+        self._copier = relocate.ResumableCopier()
+        copy = self._copier.copy
+        
+        self._funcs = {"Move": self._copier.move, "Copy": copy}
+        for action, link in LINKMODES.values():
+            self._funcs[action] = relocate.with_fallback(link, action, copy)
+        
+        if OPTS["LINKMODE"]:
+            self.action, link = LINKMODES[OPTS["LINKMODE"]]
+            self._move_func = relocate.with_fallback(link, self.action, copy)
+        elif OPTS["SAFERENAME"]:
             self.action = "Copy"
-            self._move_func = shutil.copy
+            self._move_func = copy
         else:
             self.action = "Move"
-            self._move_func = shutil.move
+            self._move_func = self._copier.move
         
         if OPTS["DRYRUN"]:
             self._move_func = lambda x = None, y = None: None
+            for action in self._funcs:
+                self._funcs[action] = self._move_func
+        
+        self.scheduler = None
+        if OPTS["JOBS"]:
+            self.scheduler = RelocationScheduler(self._relocate_file,
+                                                 OPTS["JOBS"])
+        # What is already in the destination directories, and taken by
+        # earlier files in this run, and the device of each directory
+        self._dest = DestinationIndex()
+        self._devices = {}
     
 
     def add_file(self, f): 
         self.files.append(f)
     
 
-    def process(self): 
-        for f in self.files:
+    def process(self, files=None): 
+        # files can be any iterable, they are processed as it yields them
+        if files == None:
+            files = self.files
+        
+        for f in files:
             self._do_process(f)
+        
+        self._finish()
+    
+
+    def apply(self, f): 
+        """ Carries out the relocations in a plan written with --plan """
+        for action, old, new, reason in read_plan(f):
+            if action not in self._funcs:
+                continue
+            
+            if not os.path.exists(old):
+                LOGGER.info("Cannot {0} - {1} ==> {2}\n".format(action, old, new) +\
+                        "The file no longer exists.")
+                continue
+            
+            self._make_dirs(os.path.dirname(new))
+            if self._collides(action, old, new):
+                continue
+            
+            if self.scheduler:
+                self._schedule(None, old, new, action)
+            else:
+                self._relocate_file(old, new, action)
+        
+        self._finish()
+    
+
+    @_phase("relocate")
+    def _finish(self): 
+        if self.scheduler:
+            self.scheduler.join()
+            for line in self.scheduler.summary():
+                LOGGER.info(line)
+        for line in self._copier.summary():
+            LOGGER.info(line)
+        self._copier.reset()
+        if STATS:
+            STATS.count("listdir", self._dest.listings)
+        # Another batch in --watch mode should see the library as it is then
+        self._dest.clear()
     
 
     def _do_process(self, o): 
@@ -524,48 +1279,925 @@ class Processor:
         
         if new == False:
             LOGGER.info("{0} - Cannot Be renamed".format(old))
-            return 1
+            return self._skipped(o, old, None, "unparsed")
         
         t, h = os.path.split(new)
         
         path = os.path.join(OPTS["OUTPUTDIR"], t)
-        if not os.path.isdir(path) and not OPTS["DRYRUN"]:
-            os.makedirs(path)
-            LOGGER.info("Created Directory Structure - {0}".format(path))
+        self._make_dirs(path)
         
         new = os.path.join(path, h)
         
-        if old == new:
+        if self._same_path(old, new):
             LOGGER.info("{0} not changed - Identical Names".format(old))
-            return 1
+            return self._skipped(o, old, new, "identical")
+        
+        reason = self._collides(self.action, old, new)
+        if reason:
+            return self._skipped(o, old, new, reason)
+        
+        if self.plan:
+            self._planned(self.action, old, new)
+        else:
+            if OPTS["CORRECT"] and not OPTS["DRYRUN"]:
+                self._learn_show(o)
+            
+            if self.scheduler:
+                self._schedule(o, old, new)
+            elif not self._relocate_file(old, new):
+                return 0
+        
+        self._do_sidecars(o, new)
+        
+        return 0
+    
+
+    def _do_sidecars(self, o, new): 
+        # Sidecars take the episode's new name, keeping any tag like ".en"
+        directory, stem = os.path.split(os.path.splitext(new)[0])
+        sub_formats = OPTS["SUBFORMATS"]
+        
+        for old, entry, tag in o.sidecars:
+            ext = os.path.splitext(old)[1]
+            path = directory
+            if OPTS["SUBSDIR"] and ext.lower() in sub_formats:
+                path = os.path.join(directory, OPTS["SUBSDIR"])
+                self._make_dirs(path)
+            dst = os.path.join(path, stem + tag + ext)
+            
+            if self._same_path(old, dst):
+                continue
+            reason = self._collides(self.action, old, dst)
+            if reason:
+                if self.manifest:
+                    self.manifest.record(old, reason)
+                self._planned("Skip", old, dst, reason)
+            elif self.plan:
+                self._planned(self.action, old, dst)
+            elif self.scheduler:
+                self._schedule(None, old, dst)
+            else:
+                self._relocate_file(old, dst)
+    
+
+    def _skipped(self, o, old, new, reason): 
+        # Files left where they are do not need looking at again
+        if self.manifest:
+            self.manifest.record(old, reason)
+            for path, entry, tag in o.sidecars:
+                self.manifest.record(path, reason)
+        
+        return self._planned("Skip", old, new, reason)
+    
+
+    def _planned(self, action, old, new, reason=""): 
+        if self.results != None:
+            self._result(action, old, new, reason or "planned")
+        if self.plan:
+            write_plan(self.plan, action, os.path.abspath(old),
+                       new and os.path.abspath(new), reason)
+            LOGGER.debug("Planned %s %s -> %s %s", action, old, new, reason)
+        
+        return 1 if reason else 0
+    
+
+    def _result(self, action, old, new, outcome): 
+        self.results.append((action, os.path.abspath(old),
+                             new and os.path.abspath(new), outcome))
+    
+
+    @_phase("collision")
+    def _make_dirs(self, path): 
+        if OPTS["DRYRUN"] or self.plan:
+            return
+        if self._dest.make_dirs(path):
+            if STATS:
+                STATS.count("mkdir")
+            LOGGER.info("Created Directory Structure - {0}".format(path))
+    
+
+    @_phase("collision")
+    def _same_path(self, old, new): 
+        """ True if old and new name the same path, however they are
+            spelled or whatever links lead there """
+        if old == new:
+            return True
+        if not self._dest.exists(new):
+            return False
+        return os.path.realpath(old) == os.path.realpath(new)
+    
+
+    @_phase("collision")
+    def _collides(self, action, old, new): 
+        """ Returns why old cannot go to new, "exists", "duplicate" or
+            "identical", or None if it can """
+        # Jobs run out of order and dry runs or plans never create the file,
+        # so a destination can only be claimed once, whichever file reaches
+        # it first in the input wins.
+        if self._dest.claimed(new):
+            LOGGER.info("Cannot {0} - {1} ==> {2}\n".format(action, old, new) +\
+                    "An earlier file in this run is going to this path.")
+            return "exists"
+        
+        # A hard link to old, never to be removed or written over
+        if self._dest.exists(new) and same_file(old, new):
+            LOGGER.info("{0} is already at {1} - Skipped".format(old, new))
+            return "identical"
         
-        if os.path.isfile(new) and not OPTS["OVERWRITE"]:
-            LOGGER.info("Cannot {0} - {1} ==> {2}\n".format(self.action, old, new) +\
+        if self._dest.exists(new) and not OPTS["OVERWRITE"]:
+            if self.duplicates and self.duplicates.same(old, new):
+                self._duplicate(action, old, new)
+                return "duplicate"
+            
+            LOGGER.info("Cannot {0} - {1} ==> {2}\n".format(action, old, new) +\
                     "A file already exists at this path. " +\
                     "Add -D to force an overwrite")
-            return 1
+            return "exists"
         
-        self._relocate_file(old, new)
+        self._dest.claim(new)
+        return None
+    
+
+    def _duplicate(self, action, old, new): 
+        # Only a file that would have been moved away is ever removed
+        if OPTS["DUPLICATES"] != "remove" or action != "Move" or self.plan:
+            LOGGER.info("{0} is identical to {1} - Skipped".format(old, new))
+            return
         
-        return 0
+        if OPTS["DRYRUN"]:
+            LOGGER.info("{0} is identical to {1} - Removed".format(old, new))
+            return
+        
+        try:
+            os.remove(old)
+            if STATS:
+                STATS.count("duplicates removed")
+            LOGGER.info("{0} is identical to {1} - Removed".format(old, new))
+        except OSError, e:
+            LOGGER.info("{0} is identical to {1} - Cannot remove - {2}".format(
+                        old, new, e.strerror))
+    
 
+    def _learn_show(self, o): 
+        name = o.show_name
+        if name and OPTS["DELIM"]:
+            name = name.replace(OPTS["DELIM"], " ")
+        if name and show_index().add(name.lower()):
+            LOGGER.debug("Added show '%s'", name)
+    
 
-    def _relocate_file(self, src, dst): 
+    @_phase("relocate")
+    def _schedule(self, o, old, new, action=None): 
+        try:
+            st = o.stat() if o else os.stat(old)
+            src_dev, size = st.st_dev, st.st_size
+        except OSError:
+            src_dev, size = None, 0
+        
+        key = (src_dev, self._device(os.path.dirname(new)))
+        self.scheduler.submit(old, new, size, key, action)
+        
+        return 0
+    
+
+    def _device(self, path): 
+        # Directories may not exist yet on a dry run, use the nearest parent
+        if path not in self._devices:
+            p = os.path.abspath(path)
+            while not os.path.exists(p) and os.path.dirname(p) != p:
+                p = os.path.dirname(p)
+            self._devices[path] = os.stat(p).st_dev
+        
+        return self._devices[path]
+
+
+    @_phase("relocate")
+    def _relocate_file(self, src, dst, action=None): 
+         if action:
+            move_func = self._funcs[action]
+         else:
+            action, move_func = self.action, self._move_func
+         
+         if self.journal:
+            src_abs, dst_abs = os.path.abspath(src), os.path.abspath(dst)
+            # Only -D lets a relocation replace a file that was there
+            replacing = OPTS["OVERWRITE"] and os.path.lexists(dst)
+            self.journal.begin(action, src_abs, dst_abs, replacing)
+         
          try:
-            self._move_func(src, dst)
-            LOGGER.info("{0} {1} -> {2} | Success".format(self.action, src, dst.replace(OPTS["OUTPUTDIR"] + "/","")))
-         except e:
-            LOGGER.info("{0} {1} -> {2} | Failed".format(self.action, src, dst)) 
+            move_func(src, dst)
+            if action == "Move" and not OPTS["DRYRUN"]:
+                # Frees the name for a later file renamed in place
+                self._dest.discard(src)
+            if self.journal:
+                self.journal.done(action, src_abs, dst_abs)
+                if action != "Symlink":
+                    self._set_origin(dst, src_abs)
+            if STATS:
+                self._count(action, dst)
+            if self.manifest:
+                self.manifest.forget(dst)
+                if action != "Move":
+                    self.manifest.record(src, action.lower())
+            if self.results != None:
+                self._result(action, src, dst,
+                             "dry run" if OPTS["DRYRUN"] else "done")
+            LOGGER.info("{0} {1} -> {2} | Success".format(action, src, dst.replace(OPTS["OUTPUTDIR"] + "/","")))
+            return True
+         except (IOError, OSError), e:
+            if self.journal:
+                self.journal.done(action, src_abs, dst_abs, False)
+            if STATS:
+                STATS.count("failed")
+            if self.results != None:
+                self._result(action, src, dst, "failed")
+            LOGGER.info("{0} {1} -> {2} | Failed".format(action, src, dst)) 
+            return False
+    
 
-def is_playable(x): 
+    def _set_origin(self, dst, origin): 
+        # The file is already in place, failing here must not fail the move
+        try:
+            journal.set_origin(dst, origin)
+        except OSError, e:
+            LOGGER.info("Cannot record the origin of {0} - {1}".format(
+                        dst, e.strerror))
+    
+
+    def _count(self, action, dst): 
+        # A dry run relocates nothing
+        if OPTS["DRYRUN"]:
+            STATS.count("planned")
+            return
+        STATS.count("relocated")
+        STATS.count(action.lower())
+        try:
+            STATS.count("bytes", os.lstat(dst).st_size)
+        except OSError:
+            pass
+    
+
+    def revert(self, ops): 
+        """ Undoes (run, action, source, destination, created) relocations
+            in the order given, in parallel when there is a scheduler. A
+            file is only put back if nothing has taken its original place,
+            a copy or link is only removed if its run created it."""
+        busy = set()
+        
+        for run, action, src, dst, created in ops:
+            if self.scheduler:
+                # A path used twice has to wait for the first use to finish
+                if src in busy or dst in busy:
+                    self.scheduler.join()
+                    busy.clear()
+                busy.update((src, dst))
+                
+                try:
+                    st = os.lstat(dst)
+                    src_dev, size = st.st_dev, st.st_size
+                except OSError:
+                    src_dev, size = None, 0
+                key = (src_dev, self._device(os.path.dirname(src)))
+                self.scheduler.submit(dst, src, size, key, run, action,
+                                      created)
+            else:
+                self._revert_file(dst, src, run, action, created)
+        
+        self._finish()
+    
+
+    def _revert_file(self, dst, src, run, action, created=True): 
+        # Called as (current path, original path) like the other relocations
+        if action != "Move" and not created:
+            LOGGER.info("Cannot revert {0} {1} -> {2} - It replaced a file "
+                        "that was already there".format(action, src, dst))
+            return False
+        
+        if action == "Move":
+            ok = os.path.lexists(dst) and not os.path.lexists(src)
+        else:
+            ok = os.path.lexists(dst) and os.path.exists(src)
+        
+        if not ok:
+            LOGGER.info("Cannot revert {0} {1} -> {2}".format(action, src, dst))
+            return False
+        
+        try:
+            if OPTS["DRYRUN"]:
+                pass
+            elif action == "Move":
+                if not os.path.isdir(os.path.dirname(src)):
+                    os.makedirs(os.path.dirname(src))
+                shutil.move(dst, src)
+            else:
+                os.remove(dst)
+        except (IOError, OSError), e:
+            LOGGER.info("Revert {0} {1} -> {2} | Failed - {3}".format(action, src, dst, e))
+            return False
+        
+        if self.journal and not OPTS["DRYRUN"]:
+            self.journal.reverted(run, action, src, dst)
+        LOGGER.info("Revert {0} {1} -> {2} | Success".format(action, src, dst))
+        return True
+
+def parse_many(names):
+    """ Parses every name in an iterable, yielding (old, new) pairs in
+        order, exactly as FileObject.get() would return them.
+        
+        The write format and purge list are compiled once up front so
+        this is the way to plan large numbers of files."""
+    renderer = name_renderer()
+    
+    for n in names:
+        yield FileObject(n, renderer).get()
+
+
+def options_key():
+    """ Hash of everything that affects how a name is parsed and renamed """
+    parts = [OPTS[k] for k in ("WRITEFORMAT", "DELIM", "CAMALCASE", "STRICT",
+                               "SPAD", "EPAD", "SHOWNAME", "SEASON")]
+    parts += [STRIP, [p.pattern for p in REGEXS], os.sep]
+    
+    # Parses are stored before --correct is applied, see FileObject.correct()
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+
+def open_duplicates():
+    try:
+        cache = HashCache(OPTS["HASHCACHE"])
+    except sqlite3.Error, e:
+        LOGGER.info("Cannot open {0} - {1}".format(OPTS["HASHCACHE"], e))
+        cache = None
+    
+    return DuplicateFinder(cache)
+
+
+def manifest_key():
+    """ Hash of everything that affects what happens to a file """
+    parts = [options_key(), os.path.abspath(OPTS["OUTPUTDIR"])]
+    parts += [OPTS[k] for k in ("OVERWRITE", "SAFERENAME", "LINKMODE",
+                                "MEDIAFORMATS", "SIDECARS", "SUBSDIR",
+                                "DUPLICATES", "LOOKUP")]
+    
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+
+def open_manifest():
+    try:
+        return Manifest(OPTS["MANIFEST"], manifest_key())
+    except sqlite3.Error, e:
+        LOGGER.info("Cannot open {0} - {1}".format(OPTS["MANIFEST"], e))
+        return None
+
+
+def open_cache():
+    if not OPTS["CACHEFILE"]:
+        return None
+    
+    try:
+        return ParseCache(OPTS["CACHEFILE"], OPTS["CACHESIZE"])
+    except sqlite3.Error, e:
+        LOGGER.info("Cannot open cache {0} - {1}".format(OPTS["CACHEFILE"], e))
+        return None
+
+
+def _init_parse_worker(opts, strip, patterns):
+    OPTS.update(opts)
+    STRIP[:] = strip
+    REGEXS[:] = [re.compile(p, flags) for p, flags in patterns]
+
+
+def _parse_chunk(names):
+    renderer = name_renderer()
+    results = []
+    
+    # Corrected in the parent, which has the index
+    for n in names:
+        o = FileObject(n, renderer, correct=False)
+        results.append((o.parsed(), o.success))
+    
+    # Pattern counts only reach --stats through the parent
+    return results, episode_matcher().take_counts()
+
+
+class ParsePool: 
+    """ Parses names on a pool of worker processes.
+        
+        Each worker is sent OPTS, STRIP and REGEXS once when it starts,
+        names are then sent in chunks and only the parsed values come
+        back, in the order the names were given, along with the counts
+        of the worker's EpisodeMatcher for the chunk."""
+    
+    def __init__(self, processes, chunk_size=250):
+        # Only imported when used, it is slow to load
+        import multiprocessing
+        
+        self.chunk_size = chunk_size
+        # Enough names per call to keep every worker busy
+        self.batch_size = chunk_size * processes * 4
+        self.pool = multiprocessing.Pool(processes, _init_parse_worker,
+                                         (dict(OPTS), list(STRIP),
+                                          [(p.pattern, p.flags) for p in REGEXS]))
+    
+
+    @_phase("parse")
+    def parse(self, names): 
+        """ Returns [(values, success)] for names, values being the
+            FileObject.parsed() tuple of each """
+        chunks = [names[i:i + self.chunk_size]
+                  for i in range(0, len(names), self.chunk_size)]
+        results = []
+        matcher = episode_matcher()
+        
+        for chunk, counts in self.pool.imap(_parse_chunk, chunks):
+            results.extend(chunk)
+            matcher.add_counts(counts)
+        
+        return results
+    
+
+    def close(self): 
+        self.pool.close()
+        self.pool.join()
+
+
+def cached_files(found, cache=None, batch_size=500, pool=None):
+    """ Generator of FileObjects for (path, entry) pairs.
+        
+        Names are looked up in the cache a batch at a time, only those
+        missing are parsed, on pool when given, and they are then added
+        to the cache. Batches start small and double up to batch_size so
+        the first files are not held up waiting for a full batch."""
+    renderer = name_renderer()
+    key = options_key() if cache else None
+    found = iter(found)
+    if pool:
+        batch_size = max(batch_size, pool.batch_size)
+    size = min(batch_size, 16)
+    
+    while True:
+        batch = list(itertools.islice(found, size))
+        size = min(size * 2, batch_size)
+        if not batch:
+            return
+        
+        names = [os.path.basename(f) for f, e in batch]
+        hits = cache.lookup(names, key) if cache else {}
+        if STATS and cache:
+            STATS.count("cache hits", len(hits))
+        if pool:
+            missing = sorted(set(names).difference(hits))
+            hits.update(zip(missing, pool.parse(missing)))
+            new = [(n, hits[n][0], hits[n][1]) for n in missing]
+        else:
+            new = []
+        objs = []
+        
+        for (f, e), n in zip(batch, names):
+            o = FileObject(f, renderer, e, hits.get(n), correct=False)
+            if n not in hits:
+                new.append((n, o.parsed(), o.success))
+            objs.append(o)
+        
+        if new and cache:
+            cache.store(new, key)
+        
+        for o in objs:
+            o.correct()
+            yield o
+
+
+def open_lookup():
+    import metadata
+    
+    provider = metadata.PROVIDERS[OPTS["LOOKUP"]]
+    if OPTS["LOOKUPURL"]:
+        provider = provider(OPTS["LOOKUPURL"])
+    else:
+        provider = provider()
+    
+    try:
+        cache = metadata.TitleCache(OPTS["TITLECACHE"], OPTS["TITLETTL"])
+    except sqlite3.Error, e:
+        LOGGER.info("Cannot open {0} - {1}".format(OPTS["TITLECACHE"], e))
+        cache = None
+    
+    return metadata.TitleLookup(provider, cache)
+
+
+def with_titles(files, lookup, batch_size=200):
+    """ Generator filling in episode names from lookup for FileObjects.
+        
+        Files are taken a batch at a time so each show is only looked up
+        once however many of its files are in the batch."""
+    files = iter(files)
+    
+    while True:
+        batch = list(itertools.islice(files, batch_size))
+        if not batch:
+            return
+        
+        shows = {}
+        for o in batch:
+            if o.success:
+                show = o.show_name.replace(OPTS["DELIM"] or " ", " ")
+                shows.setdefault(show, []).append(o)
+        
+        if STATS:
+            STATS.start("lookup")
+        titles = lookup.fetch(shows.keys()) if shows else {}
+        if STATS:
+            STATS.stop()
+        for show, objs in shows.iteritems():
+            for o in objs:
+                try:
+                    key = (int(o.season), int(o.episode))
+                except ValueError:
+                    continue
+                if titles.get(show) and titles[show].get(key):
+                    o.set_episode_name(titles[show][key])
+        
+        for o in batch:
+            yield o
+
+
+def is_playable(x, formats=None): 
     # This filters out files that are not media files
     _, ext = os.path.splitext(x)
-    if ext in OPTS["MEDIAFORMATS"]:
+    if ext in (formats or OPTS["MEDIAFORMATS"]):
         return True
     else:
         return False
 
 
+def search_formats():
+    """ Extensions of the files to search for, media files and the sidecar
+        files that go with them """
+    formats = set(OPTS["MEDIAFORMATS"])
+    if OPTS["SIDECARS"]:
+        formats.update(OPTS["SUBFORMATS"])
+        formats.update(OPTS["SIDECARFORMATS"])
+    return frozenset(formats)
+
+
+_STEM_RE = re.compile("[\W_]+")
+
+def _stem_key(stem):
+    return _STEM_RE.sub(".", stem.lower()).strip(".")
+
+
+def group_sidecars(found, sidecars):
+    """ Generator of (path, entry) pairs for the files in found that are
+        parsed on their own.
+        
+        Each directory's files are indexed by their normalized stem in one
+        pass and a subtitle or other sidecar file whose stem, less up to
+        two trailing tags such as ".en.forced", is an episode's is stored
+        in sidecars[episode path] as (path, entry, tag) instead. Subtitles
+        without an episode are passed on as before, other sidecars are
+        dropped.
+        
+        A directory's files must come together, as they do from scan()."""
+    sub_formats = frozenset(OPTS["SUBFORMATS"])
+    sidecar_formats = sub_formats.union(OPTS["SIDECARFORMATS"])
+    media_formats = frozenset(OPTS["MEDIAFORMATS"])
+    
+    for _, files in itertools.groupby(found, lambda f: os.path.dirname(f[0])):
+        files = list(files)
+        episodes = {}
+        attached = set()
+        
+        for f, e in files:
+            stem, ext = os.path.splitext(os.path.basename(f))
+            if ext in media_formats and ext not in sidecar_formats:
+                episodes.setdefault(_stem_key(stem), f)
+        
+        for f, e in files:
+            stem, ext = os.path.splitext(os.path.basename(f))
+            if ext not in sidecar_formats or not episodes:
+                continue
+            
+            tag = ""
+            for _ in range(3):
+                episode = episodes.get(_stem_key(stem))
+                if episode:
+                    sidecars.setdefault(episode, []).append((f, e, tag))
+                    attached.add(f)
+                    break
+                if "." not in stem:
+                    break
+                stem, t = stem.rsplit(".", 1)
+                tag = "." + t + tag
+        
+        for f, e in files:
+            if f not in attached and is_playable(f, media_formats):
+                yield f, e
+
+
+class _Entry(object): 
+    """ Stand in for os.DirEntry when scandir is not available. One stat
+        call answers both is_dir() and stat() unless the entry is a
+        symbolic link, as DirEntry does."""
+    
+    __slots__ = ("name", "path", "_stat", "_lstat")
+    
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = self._lstat = None
+    
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            if follow_symlinks:
+                return stat.S_ISDIR(self.stat().st_mode)
+            return stat.S_ISDIR(self.stat(False).st_mode)
+        except OSError:
+            return False
+    
+
+    def stat(self, follow_symlinks=True):
+        if self._stat == None and self._lstat == None:
+            if STATS:
+                STATS.count("stat")
+            self._lstat = os.lstat(self.path)
+        if self._stat == None and not stat.S_ISLNK(self._lstat.st_mode):
+            self._stat = self._lstat
+        if not follow_symlinks:
+            return self._lstat or self._stat
+        if self._stat == None:
+            if STATS:
+                STATS.count("stat")
+            self._stat = os.stat(self.path)
+        return self._stat
+
+
+def _list_dir(d):
+    if STATS:
+        STATS.count("listdir")
+    try:
+        if scandir:
+            return list(scandir(d))
+        return [_Entry(d, n) for n in os.listdir(d)]
+    except OSError, e:
+        LOGGER.info("Cannot search {0} - {1}".format(d, e.strerror))
+        return []
+
+
+def _skip(name, patterns):
+    for p in patterns:
+        if fnmatch.fnmatchcase(name, p):
+            return True
+    return False
+
+
+def scan_filters():
+    """ Returns a pair of functions, wanted(path) is True for media files
+        that should be processed and descend(path) is True for directories
+        that should be searched.
+        
+        Hidden directories, partial download directories and anything
+        matching OPTS["EXCLUDE"] are skipped, as is OPTS["OUTPUTDIR"] so
+        moved files are not found again."""
+    formats = search_formats()
+    exclude = list(OPTS["EXCLUDE"])
+    skip_dirs = [d.lower() for d in OPTS["SKIPDIRS"]]
+    output_dir = os.path.realpath(OPTS["OUTPUTDIR"])
+    
+    def wanted(path):
+        name = os.path.basename(path)
+        return (is_playable(name, formats) and
+                not (_skip(name, exclude) or _skip(path, exclude)))
+    
+    def descend(path):
+        name = os.path.basename(path)
+        return not (name.startswith(".") or _skip(name.lower(), skip_dirs) or
+                    _skip(name, exclude) or _skip(path, exclude) or
+                    os.path.realpath(path) == output_dir)
+    
+    return wanted, descend
+
+
+def _manifest_entries(d, manifest):
+    """ Returns the entries of d that need looking at and the listing to
+        pass on to manifest.listed(), which is None when d is settled and
+        only its subdirectories are returned """
+    key = os.path.abspath(d)
+    try:
+        mtime = os.stat(d).st_mtime
+    except OSError, e:
+        LOGGER.info("Cannot search {0} - {1}".format(d, e.strerror))
+        return [], None
+    
+    subdirs = manifest.unchanged(key, mtime)
+    if subdirs != None:
+        if STATS:
+            STATS.count("settled dirs")
+        return [_Entry(d, n) for n in subdirs], None
+    
+    if STATS:
+        STATS.count("listdir")
+    try:
+        names = os.listdir(d)
+    except OSError, e:
+        LOGGER.info("Cannot search {0} - {1}".format(d, e.strerror))
+        return [], None
+    
+    known = manifest.known(key)
+    looked = [n for n in names if n not in known]
+    return [_Entry(d, n) for n in looked], (key, mtime, names, known, looked)
+
+
+def scan(paths, max_depth=0, manifest=None):
+    """ Generator yielding (path, entry) for each media file found under
+        paths, one directory at a time so files can be processed while the
+        rest of the tree is still being searched.
+        
+        entry is the DirEntry for the file and its stat() result is cached,
+        it is None for files named directly. See scan_filters() for what
+        is skipped.
+        
+        With a manifest, settled directories that have not changed are not
+        listed and files with an outcome from an earlier run are left out."""
+    wanted, descend = scan_filters()
+    
+    for top in paths:
+        if not os.path.isdir(top):
+            if wanted(top):
+                yield top, None
+            continue
+        
+        # Paths under "." are given without a leading "./"
+        pending = [("" if top == "." else top, top, 0)]
+        while pending:
+            prefix, d, depth = pending.pop()
+            subdirs = []
+            
+            if manifest:
+                entries, listing = _manifest_entries(d, manifest)
+            else:
+                entries, listing = _list_dir(d), None
+            dirs = []
+            # Beyond the depth limit only media names need a stat, to tell
+            # them from directories with names like them
+            last = max_depth != None and depth >= max_depth
+            for e in entries:
+                path = os.path.join(prefix, e.name)
+                
+                if last and not wanted(path):
+                    continue
+                if e.is_dir(follow_symlinks=False):
+                    dirs.append(e.name)
+                    if ((max_depth == None or depth < max_depth) and
+                            descend(path)):
+                        subdirs.append((path, e.path, depth + 1))
+                elif wanted(path):
+                    yield path, e
+            
+            if listing:
+                manifest.listed(*listing + (dirs,))
+            subdirs.reverse()
+            pending.extend(subdirs)
+
+
+def file_objects(found, cache=None, lookup=None, pool=None):
+    """ FileObjects for (path, entry) pairs, using the parse cache and
+        episode name lookup when they are enabled and with sidecar files
+        attached to their episode."""
+    if OPTS["SIDECARS"]:
+        sidecars = {}
+        found = group_sidecars(found, sidecars)
+    
+    if cache or pool:
+        files = cached_files(found, cache, pool=pool)
+    else:
+        files = (FileObject(f, entry=e) for f, e in found)
+    
+    if lookup:
+        files = with_titles(files, lookup)
+    
+    if OPTS["SIDECARS"]:
+        files = _with_sidecars(files, sidecars)
+    
+    if STATS:
+        files = STATS.timed("parse", files)
+    
+    return files
+
+
+def _with_sidecars(files, sidecars):
+    for o in files:
+        o.sidecars = sidecars.pop(o.start_name, ())
+        yield o
+
+
+def watch(processor, cache, lookup):
+    """ Renames files as they arrive in OPTS["WATCH"] until interrupted """
+    wanted, descend = scan_filters()
+    watcher = Watcher(OPTS["WATCH"], wanted, descend, OPTS["RECURSIVE"],
+                      OPTS["SETTLE"], OPTS["DEBOUNCE"])
+    LOGGER.info("Watching {0}".format(OPTS["WATCH"]))
+    
+    try:
+        for batch in watcher.batches():
+            # Keeps each directory's files together for group_sidecars()
+            found = [(f, None) for f in sorted(batch, key=os.path.split)]
+            processor.process(file_objects(found, cache, lookup))
+    except KeyboardInterrupt:
+        LOGGER.info("Stopped watching {0}".format(OPTS["WATCH"]))
+
+
+def revert(run):
+    """ Undoes the relocations recorded in the journal for run, "last",
+        "all" or a run id, newest first """
+    path = OPTS["JOURNAL"]
+    if not path or not os.path.isfile(path):
+        LOGGER.info("No journal to revert from")
+        return
+    
+    if run == "last":
+        ids = journal.runs(path)
+        run = ids[-1] if ids else None
+        if not run:
+            return
+    elif run == "all":
+        run = None
+    
+    ops = [o[:4] + o[5:] for o in journal.outcomes(path, run)
+           if o[4] in ("D", "B")]
+    ops.reverse()
+    LOGGER.info("Reverting {0} relocations".format(len(ops)))
+    
+    j = journal.Journal(path)
+    processor = Processor(journal=j)
+    processor.scheduler = RelocationScheduler(processor._revert_file,
+                                              OPTS["JOBS"] or 4)
+    try:
+        processor.revert(ops)
+    finally:
+        j.close()
+
+
+def run(processor, found, cache, lookup, test=False, pool=None):
+    """ Processes every (path, entry) pair in found once.
+        
+        Unless OPTS["QUEUE"] is 0, scanning and parsing each run on a
+        thread of their own while files are relocated on this one."""
+    stages = []
+    if OPTS["QUEUE"] and not test:
+        # Parsing only reads the index, it is opened here where it is added to
+        if OPTS["CORRECT"]:
+            show_index()
+        found = Stage(found, OPTS["QUEUE"], "scan")
+        stages.append(found)
+        if STATS:
+            # Charged on the parse stage's thread
+            found = STATS.timed("wait", found)
+    
+    files = file_objects(found, cache, lookup, pool)
+    
+    if stages:
+        files = Stage(files, OPTS["QUEUE"], "parse")
+        stages.append(files)
+        if STATS:
+            files = STATS.timed("wait", files)
+
+    if test:
+        for f in files:
+            processor.add_file(f)
+        files = None
+
+        for f in processor.files:
+            i = raw_input(".")
+            LOGGER.setLevel(logging.DEBUG)
+            if i == "q":
+                break
+        
+    processor.process(files)
+    
+    if STATS:
+        for stage in stages:
+            STATS.count(stage.name + " starved", stage.starved)
+            STATS.count(stage.name + " blocked", stage.blocked)
+    
+    for line in episode_matcher().stats():
+        LOGGER.debug(line)
+
+
+def report_stats():
+    """ Logs the --stats figures and writes them to OPTS["STATSJSON"] """
+    STATS.finish()
+    patterns = episode_matcher().counts()
+    
+    for line in STATS.report(patterns):
+        LOGGER.info(line)
+    
+    if OPTS["STATSJSON"]:
+        import json
+        with open(OPTS["STATSJSON"], "w") as f:
+            json.dump(STATS.as_dict(patterns), f, indent=2)
+
+
 def __usage(x): 
     if x == 1:
         print __doc__
@@ -575,38 +2207,58 @@ def __usage(x):
         pass
 
 
-def main(argv = None): 
-    short_args = "d:cl:w:o:rhDStp:xv"
-    long_args = ["camelcase",     # c - CAMELCASE   flag
-                 "overwrite",     # D - OVERWRITE   flag
-                 "saferename",    # r - SAFERENAME  flag
-                 "strict",        # s - STRICT      flag
-                 "dryrun",        # x - DRYRUN      flag
-                 "verbose",       # v - verbose     flag
-                 "logfile=",      # l - LOGFILE     arg
-                 "writeformat=",  # w - WRITEFORMAT arg
-                 "outputdir=",    # o - OUTPUTDIR   arg
-                 "delimiter=",    # d - DELIM       arg
-                 "purge=",        # p - STRIP       arg
-                 "epad=",         # EPAD            arg
-                 "spad=",         # SPAD            arg
-                 "season=",       # SEASON          arg
-                 "showname=",     # SHOWNAME        arg
-                 "help",
-                 "license",
-                 ]
-
-    if argv == None:
-        argv = sys.argv[1:]
-
-    try:
-        opts, args = getopt.getopt(argv, short_args, long_args)
-    except getopt.GetoptError, e:
-        __usage()
-        print str(e)
-        sys.exit(1)
-
-    TEST = False
+SHORT_ARGS = "d:cl:w:o:rhDStp:xvRj:"
+LONG_ARGS = ["camelcase",     # c - CAMELCASE   flag
+             "overwrite",     # D - OVERWRITE   flag
+             "saferename",    # r - SAFERENAME  flag
+             "strict",        # s - STRICT      flag
+             "dryrun",        # x - DRYRUN      flag
+             "verbose",       # v - verbose     flag
+             "logfile=",      # l - LOGFILE     arg
+             "writeformat=",  # w - WRITEFORMAT arg
+             "outputdir=",    # o - OUTPUTDIR   arg
+             "delimiter=",    # d - DELIM       arg
+             "purge=",        # p - STRIP       arg
+             "epad=",         # EPAD            arg
+             "spad=",         # SPAD            arg
+             "season=",       # SEASON          arg
+             "showname=",     # SHOWNAME        arg
+             "recursive",     # R - RECURSIVE   flag
+             "maxdepth=",     # MAXDEPTH        arg
+             "exclude=",      # EXCLUDE         arg
+             "jobs=",         # j - JOBS        arg
+             "link=",         # LINKMODE        arg
+             "no-cache",      # CACHEFILE       flag
+             "no-manifest",   # MANIFEST        flag
+             "watch=",        # WATCH           arg
+             "lookup=",       # LOOKUP          arg
+             "lookup-url=",   # LOOKUPURL       arg
+             "plan=",         # PLAN            arg
+             "apply=",        # APPLY           arg
+             "processes=",    # PROCESSES       arg
+             "duplicates=",   # DUPLICATES      arg
+             "stats",         # STATS           flag
+             "stats-json=",   # STATSJSON       arg
+             "profile=",      # PROFILE         arg
+             "journal=",      # JOURNAL         arg
+             "journal-keep=", # JOURNALKEEP     arg
+             "revert=",       # REVERT          arg
+             "subs=",         # SUBSDIR         arg
+             "no-sidecars",   # SIDECARS        flag
+             "correct",       # CORRECT         flag
+             "similarity=",   # SIMILARITY      arg
+             "queue=",        # QUEUE           arg
+             "serve",         # SERVE           flag
+             "socket=",       # SOCKET          arg
+             "help",
+             "license",
+             ]
+
+
+def apply_options(opts):
+    """ Sets OPTS from the (option, value) pairs getopt returns for
+        SHORT_ARGS and LONG_ARGS, returns True if -t was given """
+    test = False
     for opt, arg in opts:
         if opt in ["-h", "--help"]:
             __usage(1)
@@ -642,35 +2294,273 @@ def main(argv = None):
             OPTS["EPAD"] = min(int(arg), 5)
         elif opt == "--spad":
             OPTS["SPAD"] = min(int(arg), 5)
+        elif opt in ["-R", "--recursive"]:
+            OPTS["RECURSIVE"] = True
+        elif opt in ["-j", "--jobs"]:
+            OPTS["JOBS"] = int(arg)
+        elif opt == "--link":
+            if arg not in LINKMODES:
+                print "Unknown link mode - {0}".format(arg)
+                sys.exit(1)
+            OPTS["LINKMODE"] = arg
+        elif opt == "--correct":
+            OPTS["CORRECT"] = True
+        elif opt == "--similarity":
+            OPTS["SIMILARITY"] = float(arg)
+        elif opt == "--lookup":
+            import metadata
+            if arg not in metadata.PROVIDERS:
+                print "Unknown provider - {0}".format(arg)
+                sys.exit(1)
+            OPTS["LOOKUP"] = arg
+        elif opt == "--lookup-url":
+            OPTS["LOOKUPURL"] = arg
+        elif opt == "--plan":
+            OPTS["PLAN"] = arg
+        elif opt == "--apply":
+            OPTS["APPLY"] = arg
+        elif opt == "--processes":
+            OPTS["PROCESSES"] = int(arg)
+        elif opt == "--duplicates":
+            if arg not in ("skip", "remove"):
+                print "Unknown duplicates action - {0}".format(arg)
+                sys.exit(1)
+            OPTS["DUPLICATES"] = arg
+        elif opt == "--stats":
+            OPTS["STATS"] = True
+        elif opt == "--stats-json":
+            OPTS["STATSJSON"] = arg
+        elif opt == "--profile":
+            OPTS["PROFILE"] = arg
+        elif opt == "--journal":
+            OPTS["JOURNAL"] = None if arg == "NONE" else arg
+        elif opt == "--journal-keep":
+            OPTS["JOURNALKEEP"] = int(arg)
+        elif opt == "--revert":
+            OPTS["REVERT"] = arg
+        elif opt == "--watch":
+            OPTS["WATCH"] = arg
+        elif opt == "--subs":
+            OPTS["SUBSDIR"] = arg
+        elif opt == "--no-sidecars":
+            OPTS["SIDECARS"] = False
+        elif opt == "--no-cache":
+            OPTS["CACHEFILE"] = None
+        elif opt == "--no-manifest":
+            OPTS["MANIFEST"] = None
+        elif opt == "--queue":
+            OPTS["QUEUE"] = int(arg)
+        elif opt == "--serve":
+            OPTS["SERVE"] = True
+        elif opt == "--socket":
+            OPTS["SOCKET"] = arg
+        elif opt == "--maxdepth":
+            OPTS["MAXDEPTH"] = int(arg)
+        elif opt == "--exclude":
+            OPTS["EXCLUDE"].append(arg)
         elif opt == "-t":
-            TEST = True
+            test = True
         elif opt == "--license":
             __usage(2)
             sys.exit(0)
         else:
             assert 0, "Unhandled Option - {0}".format(opt)
 
+    return test
 
-    if not args:
-        fl = os.listdir(".")
-    else:
-        fl = args
 
-    processor = Processor()
-    for f in fl:
-        if is_playable(f):
-            in_f = FileObject(f)
-            processor.add_file(in_f)
+def find_files(args, manifest=None, here="."):
+    """ (path, entry) pairs for the files named in args, searching here
+        when there are none """
+    if OPTS["RECURSIVE"]:
+        return scan(args or [here], OPTS["MAXDEPTH"], manifest)
+    elif not args:
+        return scan([here], 0, manifest)
+    
+    formats = search_formats()
+    return ((f, None) for f in args if is_playable(f, formats))
 
-    if TEST:
-        for f in processor.files:
-            i = raw_input(".")
-            LOGGER.setLevel(logging.DEBUG)
-            if i == "q":
-                break
+
+def rename(targets, test=False, results=None): 
+    """ Renames the files found for each (args, here) pair in targets as
+        set up by OPTS, see find_files(). (action, source, destination,
+        outcome) is added to results for each file when it is given."""
+    global STATS
+    STATS = None
+    
+    manifest = None
+    searched = [args for args, here in targets
+                if OPTS["RECURSIVE"] or not args]
+    if searched and OPTS["MANIFEST"] and not (
+            OPTS["DRYRUN"] or OPTS["PLAN"] or OPTS["APPLY"] or
+            OPTS["WATCH"] or OPTS["REVERT"] or test):
+        manifest = open_manifest()
+    
+    found = itertools.chain.from_iterable(find_files(args, manifest, here)
+                                          for args, here in targets)
+
+    if OPTS["REVERT"]:
+        revert(OPTS["REVERT"])
+        return
+    
+    if OPTS["STATS"] or OPTS["STATSJSON"]:
+        STATS = Stats()
+        found = STATS.timed("scan", found)
+    
+    j = None
+    if OPTS["JOURNAL"] and not OPTS["DRYRUN"] and not OPTS["PLAN"]:
+        j = journal.Journal(OPTS["JOURNAL"], keep=OPTS["JOURNALKEEP"])
+    
+    duplicates = open_duplicates() if OPTS["DUPLICATES"] else None
+    
+    if OPTS["APPLY"]:
+        try:
+            with open(OPTS["APPLY"]) as f:
+                Processor(journal=j, duplicates=duplicates,
+                          results=results).apply(f)
+            if STATS:
+                report_stats()
+        finally:
+            if j:
+                j.close()
+            if duplicates:
+                duplicates.close()
+        return
+    
+    plan = None
+    if OPTS["PLAN"]:
+        plan = open(OPTS["PLAN"], "w")
+        plan.write("# action\tsource\tdestination\treason\n")
+    
+    processor = Processor(plan, j, duplicates, manifest, results)
+    cache = open_cache()
+    lookup = open_lookup() if OPTS["LOOKUP"] else None
+    pool = None
+    if OPTS["PROCESSES"] > 1 and not OPTS["WATCH"]:
+        pool = ParsePool(OPTS["PROCESSES"])
+    
+    if OPTS["WATCH"]:
+        watch(processor, cache, lookup)
+    elif OPTS["PROFILE"]:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(run, processor, found, cache, lookup, test, pool)
+        profiler.dump_stats(OPTS["PROFILE"])
+        LOGGER.info("Profile written to {0}".format(OPTS["PROFILE"]))
+    else:
+        run(processor, found, cache, lookup, test, pool)
+    
+    if STATS:
+        report_stats()
+    
+    if pool:
+        pool.close()
+    if manifest:
+        wanted = scan_filters()[0]
+        formats = frozenset(OPTS["MEDIAFORMATS"])
+        manifest.close(lambda n: is_playable(n, formats) and wanted(n))
+    if duplicates:
+        duplicates.close()
+    if plan:
+        plan.close()
+    if j:
+        j.close()
+    if cache:
+        cache.close()
+    if lookup:
+        lookup.close()
+
+
+def _job_key(job):
+    opts, args = getopt.getopt(job["argv"], SHORT_ARGS, LONG_ARGS)
+    return job["cwd"], tuple(opts)
+
+
+def _owns(paths, src):
+    for p in paths:
+        if src == p or src.startswith(p.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+def serve():
+    """ Renames jobs sent by service.py clients to OPTS["SOCKET"] until
+        interrupted. Jobs start from the options the service was started
+        with, jobs with the same options from the same directory that
+        arrive together are renamed as one batch. """
+    import copy
+    import service
+    
+    OPTS["SERVE"] = False
+    defaults = copy.deepcopy(OPTS), list(STRIP), LOGGER.level
+    
+    def handle(jobs):
+        OPTS.clear()
+        OPTS.update(copy.deepcopy(defaults[0]))
+        STRIP[:] = defaults[1]
+        LOGGER.setLevel(defaults[2])
+        
+        cwd = jobs[0]["cwd"]
+        os.chdir(cwd)
+        try:
+            apply_options(getopt.getopt(jobs[0]["argv"], SHORT_ARGS,
+                                        LONG_ARGS)[0])
+        except SystemExit:
+            return [{"error": "Bad options"}] * len(jobs)
+        if OPTS["SERVE"] or OPTS["WATCH"] or OPTS["REVERT"]:
+            return [{"error": "Not available from a client"}] * len(jobs)
+        
+        targets, owned, seen = [], [], set()
+        for job in jobs:
+            args = getopt.getopt(job["argv"], SHORT_ARGS, LONG_ARGS)[1]
+            paths = [os.path.abspath(a) for a in args]
+            owned.append(paths or [cwd])
+            # Hooks can fire twice for the same download
+            if not args and None not in seen:
+                seen.add(None)
+                targets.append(([], cwd))
+            fresh = [p for p in paths if p not in seen]
+            if fresh:
+                seen.update(fresh)
+                targets.append((fresh, cwd))
         
-    processor.process()
+        results = []
+        rename(targets, results=results)
+        
+        return [{"results": [r for r in results if _owns(paths, r[1])]}
+                for paths in owned]
     
+    try:
+        service.RenameService(OPTS["SOCKET"], _job_key,
+                              handle).serve_forever()
+    finally:
+        close_show_index()
+
+
+def main(argv = None): 
+    if argv == None:
+        argv = sys.argv[1:]
+
+    try:
+        opts, args = getopt.getopt(argv, SHORT_ARGS, LONG_ARGS)
+    except getopt.GetoptError, e:
+        __usage()
+        print str(e)
+        sys.exit(1)
+
+    test = apply_options(opts)
+
+    if sys.stdout.isatty():
+        colorize_output()
+
+    if OPTS["SERVE"]:
+        serve()
+    else:
+        try:
+            rename([(args, ".")], test)
+        finally:
+            close_show_index()
+
 
 if __name__ == "__main__":
     main()
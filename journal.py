@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Journal of relocations so a run can be reverted.
+
+Every relocation is written as a "B"egin record before the file is touched
+and a "D"one or "F"ailed record afterwards, "R" marks one that has since
+been reverted. A relocation over a file already at the destination
+begins with "O" in place of "B", reverting it must not remove that file.
+Records are flushed to the OS straight away so they survive the process
+dying and are fsynced in batches so a run of thousands of files is not
+slowed down by one fsync per file.
+
+Only the most recent runs are kept, a journal with more is rewritten
+without the oldest when a run closes it.
+
+Lines are tab separated: state, run, action, source, destination, each
+field escaped with string_escape.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import threading
+import time
+
+# Extended attribute holding the path a file had before it was renamed
+XATTR = "user.fix_nums.origin"
+
+
+# Loaded the first time it is needed, finding it runs ldconfig
+_LIBC = {}
+
+
+def _libc():
+    if "libc" not in _LIBC:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.lsetxattr
+        except (OSError, AttributeError):
+            libc = None
+        _LIBC["libc"] = libc
+    return _LIBC["libc"]
+
+
+def set_origin(path, origin):
+    """ Records origin in an xattr on path, returns False where the
+        filesystem (or platform) does not support it """
+    libc = _libc()
+    if not libc:
+        return False
+
+    r = libc.lsetxattr(path, XATTR, origin, len(origin), 0)
+    if r != 0:
+        e = ctypes.get_errno()
+        if e in (errno.ENOTSUP, errno.EOPNOTSUPP, errno.EPERM, errno.ENOENT,
+                 errno.EACCES, errno.E2BIG, errno.ENOSPC):
+            return False
+        raise OSError(e, os.strerror(e))
+    return True
+
+
+class Journal:
+    """ Append only journal for one run. Closing it drops all but the keep
+        most recent runs, none when keep is 0. """
+
+    def __init__(self, path, sync_every=64, sync_interval=1.0, keep=0):
+        self.path = path
+        self.keep = keep
+        self.run = "{0}-{1}".format(int(time.time()), os.getpid())
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._f = open(path, "a")
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def _write(self, state, action, src, dst, run=None):
+        line = "\t".join(x.encode("string_escape") for x in
+                         (state, run or self.run, action, src, dst)) + "\n"
+
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            self._unsynced += 1
+            if (self._unsynced >= self.sync_every or
+                    time.time() - self._synced_at >= self.sync_interval):
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def begin(self, action, src, dst, replacing=False):
+        """ replacing is True when dst already exists and is overwritten """
+        self._write("O" if replacing else "B", action, src, dst)
+
+    def done(self, action, src, dst, ok=True):
+        self._write("D" if ok else "F", action, src, dst)
+
+    def reverted(self, run, action, src, dst):
+        """ Marks a relocation from an earlier run as undone """
+        self._write("R", action, src, dst, run)
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._f.close()
+        if self.keep:
+            prune(self.path, self.keep)
+
+
+def read(path):
+    """ Generator of (state, run, action, source, destination) records """
+    with open(path) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                # Torn final line from a crash
+                return
+            yield tuple(x.decode("string_escape")
+                        for x in line.rstrip("\n").split("\t"))
+
+
+def runs(path):
+    """ Run ids in the order they appear in the journal """
+    seen = []
+    for r in read(path):
+        if r[1] not in seen:
+            seen.append(r[1])
+    return seen
+
+
+def outcomes(path, run=None):
+    """ Returns [(run, action, source, destination, state, created)] for
+        every relocation in run (or every run) in the order they were
+        started, state being the latest record for it: "D" done, "F"
+        failed, "R" reverted or "B" when the run stopped before it
+        finished. created is False when the destination was already there
+        and was overwritten. """
+    order = []
+    state = {}
+    created = {}
+
+    for s, r, action, src, dst in read(path):
+        if run and r != run:
+            continue
+        key = (r, action, src, dst)
+        if s in ("B", "O"):
+            if key not in state:
+                order.append(key)
+            state[key] = "B"
+            created[key] = s == "B"
+        elif key in state:
+            state[key] = s
+
+    return [k + (state[k], created[k]) for k in order]
+
+
+def prune(path, keep):
+    """ Drops all but the keep most recent runs from the journal at path,
+        returns the number of runs dropped. The journal is written afresh
+        and renamed into place so a crash leaves the old one whole. """
+    ids = runs(path)
+    if len(ids) <= keep:
+        return 0
+
+    kept = set(ids[-keep:])
+    new = path + ".new"
+    with open(path) as f:
+        with open(new, "w") as out:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                if line.split("\t", 2)[1].decode("string_escape") in kept:
+                    out.write(line)
+            out.flush()
+            os.fsync(out.fileno())
+    os.rename(new, path)
+    return len(ids) - keep
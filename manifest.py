@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Manifest of what earlier runs already dealt with.
+
+A directory is settled once every media file in it has an outcome
+recorded under the current options, its mtime is stored then. A later run
+does not list a settled directory whose mtime has not changed, it only
+stats the subdirectories it is known to have. A directory that has
+changed is listed but only names without an outcome are looked at again.
+
+Outcomes are only kept for files that stay where they are (skipped,
+copied or linked), moved files are gone from the directory anyway, and
+only when they do not depend on what is at the destination. A file kept
+out by one already there is looked at again every run.
+
+Names with an outcome are trusted without a stat, one stat per file is
+what a changed directory on a network filesystem cannot afford. A file
+relocated onto a name with an outcome, by this or a later run, has the
+outcome forgotten. One replaced by anything else under the same name
+keeps the old outcome.
+"""
+
+import os
+import sqlite3
+import threading
+
+# SQLite limits the number of parameters in a single statement
+_BATCH = 500
+# Outcomes held in memory before they are written out
+_FLUSH = 5000
+# Outcomes that only hold while the destination stays as it is
+PASSING = frozenset(["exists", "duplicate"])
+
+
+class Manifest:
+    """ SQLite store of settled directories and file outcomes for one set
+        of options """
+
+    def __init__(self, path, options):
+        self.options = options
+        # Outcomes are recorded from relocation worker threads too
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.text_factory = str
+        columns = [row[1] for row in
+                   self.db.execute("PRAGMA table_info(manifest_files)")]
+        if "size" in columns:
+            # Outcomes kept with sizes and mtimes by an earlier version
+            self.db.execute("DROP TABLE manifest_files")
+            self.db.execute("DROP TABLE IF EXISTS manifest_dirs")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS manifest_dirs (
+                               path TEXT PRIMARY KEY, options TEXT,
+                               mtime REAL, subdirs TEXT)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS manifest_files (
+                               dir TEXT, options TEXT, name TEXT,
+                               outcome TEXT,
+                               PRIMARY KEY (dir, options, name))""")
+        self.db.commit()
+        # Directory -> (mtime, names, known names, names looked at,
+        # subdirs) as listed
+        self._listed = {}
+        # (dir, name) -> outcome, and those of paths relocated onto
+        self._records = {}
+        self._forgotten = []
+        self._lock = threading.Lock()
+
+    def unchanged(self, d, mtime):
+        """ Names of the subdirectories of d if it is settled and has not
+            changed since, None if it has to be listed """
+        with self._lock:
+            row = self.db.execute("""SELECT subdirs FROM manifest_dirs WHERE
+                                     path = ? AND options = ? AND mtime = ?""",
+                                  (d, self.options, mtime)).fetchone()
+        if not row:
+            return None
+        return row[0].split("\0") if row[0] else []
+
+    def known(self, d):
+        """ Names in d with an outcome under the current options """
+        with self._lock:
+            rows = self.db.execute("""SELECT name FROM manifest_files WHERE
+                                      dir = ? AND options = ?""",
+                                   (d, self.options)).fetchall()
+        return set([name for (name,) in rows])
+
+    def _done(self, d, names):
+        """ Those of names in d with an outcome """
+        done = set()
+        for i in range(0, len(names), _BATCH):
+            chunk = names[i:i + _BATCH]
+            rows = self.db.execute("SELECT name FROM manifest_files WHERE "
+                                   "dir = ? AND options = ? AND name IN (" +
+                                   ", ".join("?" * len(chunk)) + ")",
+                                   [d, self.options] + chunk)
+            done.update(name for (name,) in rows)
+        return done
+
+    def listed(self, d, mtime, names, known, looked, subdirs):
+        """ Notes that d was listed and which of its names were looked at
+            because they were not known, to be settled by close() """
+        self._listed[d] = (mtime, names, known, looked, subdirs)
+
+    def _delete(self, d, names):
+        for i in range(0, len(names), _BATCH):
+            chunk = names[i:i + _BATCH]
+            self.db.execute("DELETE FROM manifest_files WHERE dir = ? "
+                            "AND options = ? AND name IN (" +
+                            ", ".join("?" * len(chunk)) + ")",
+                            [d, self.options] + chunk)
+
+    def record(self, path, outcome):
+        if outcome in PASSING:
+            return
+        d, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            self._records[(d, name)] = outcome
+            if len(self._records) >= _FLUSH:
+                self._flush()
+
+    def forget(self, path):
+        """ Drops the outcome for path, a file has been put there """
+        key = os.path.split(os.path.abspath(path))
+        with self._lock:
+            self._records.pop(key, None)
+            self._forgotten.append(key)
+            if len(self._forgotten) >= _FLUSH:
+                self._flush()
+
+    def _flush(self):
+        # Whatever the options, a different file is there now
+        self.db.executemany("DELETE FROM manifest_files WHERE dir = ? AND "
+                            "name = ?", self._forgotten)
+        self.db.executemany("INSERT OR REPLACE INTO manifest_files "
+                            "VALUES (?, ?, ?, ?)",
+                            [(d, self.options, name, outcome) for
+                             (d, name), outcome in self._records.iteritems()])
+        self.db.commit()
+        del self._forgotten[:]
+        self._records.clear()
+
+    def close(self, wanted=None):
+        """ Saves the outcomes recorded and, when wanted is given, settles
+            each listed directory whose media files, those wanted(name)
+            accepts, all have an outcome. Pass no wanted for a run that
+            did not finish. """
+        with self._lock:
+            self._flush()
+
+        for d, (mtime, names, known, looked, subdirs) in \
+                self._listed.iteritems():
+            if not wanted:
+                break
+            present = None
+            try:
+                now = os.stat(d).st_mtime
+                # Our own moves change it, anything new means something
+                # else did too
+                if now != mtime:
+                    present = set(os.listdir(d))
+                    if not present.issubset(names):
+                        continue
+            except OSError:
+                continue
+
+            subdirs = set(subdirs)
+            media = [n for n in looked if n not in subdirs and wanted(n) and
+                     (present == None or n in present)]
+            if len(self._done(d, media)) < len(media):
+                continue
+
+            stale = set(known).difference(names if present == None
+                                          else present)
+            self._delete(d, list(stale))
+            self.db.execute("INSERT OR REPLACE INTO manifest_dirs VALUES "
+                            "(?, ?, ?, ?)", (d, self.options, now,
+                                             "\0".join(sorted(subdirs))))
+
+        self.db.commit()
+        self.db.close()
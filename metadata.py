@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+Episode title lookup.
+
+Titles are fetched once per show for a whole batch of files, in parallel,
+over pooled keep-alive connections with a minimum gap between requests to
+the same host. Results are kept in an on-disk cache until they expire.
+
+Providers are pluggable, subclass Provider (or HTTPProvider for web APIs)
+and add it to PROVIDERS.
+"""
+
+import httplib
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+LOG = logging.getLogger()
+
+
+class Provider:
+    """ A source of episode titles """
+    name = "provider"
+
+    def titles(self, show):
+        """ Returns {(season, episode): title} for show, or None if the
+            show is not known to the provider """
+        raise NotImplementedError
+
+    def close(self):
+        """ Releases anything held between calls to titles() """
+        pass
+
+
+class _RateLimit:
+    """ Spaces out calls to wait() so they are at least interval apart """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            at = max(now, self.next)
+            self.next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class HTTPProvider(Provider):
+    """
+    Provider talking JSON over HTTP. Keep-alive connections are pooled per
+    host, a request takes an idle one or opens a new one and hands it back
+    when done, so connections outlive the threads that used them until
+    close(). Requests to a host are spaced at least interval seconds apart.
+    """
+
+    def __init__(self, base_url, interval=0.5, timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.interval = interval
+        self.timeout = timeout
+        # (scheme, netloc) -> idle connections
+        self._idle = {}
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme, netloc, fresh=False):
+        if not fresh:
+            with self._lock:
+                idle = self._idle.get((scheme, netloc))
+                if idle:
+                    return idle.pop()
+        cls = httplib.HTTPSConnection if scheme == "https" else \
+            httplib.HTTPConnection
+        return cls(netloc, timeout=self.timeout)
+
+    def _release(self, scheme, netloc, conn):
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(conn)
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle = {}
+
+    def _limit(self, netloc):
+        with self._lock:
+            if netloc not in self._limits:
+                self._limits[netloc] = _RateLimit(self.interval)
+            return self._limits[netloc]
+
+    def get_json(self, path, query=None):
+        """ GETs base_url + path, returns the decoded body or None on 404 """
+        url = self.base_url + path
+        if query:
+            url += "?" + urllib.urlencode(query)
+        scheme, netloc, path, q, _ = urlparse.urlsplit(url)
+        if q:
+            path += "?" + q
+
+        self._limit(netloc).wait()
+        # A kept alive connection may have been closed by the server
+        for attempt in (1, 2):
+            conn = self._connection(scheme, netloc, attempt == 2)
+            try:
+                conn.request("GET", path, headers={"Accept":
+                                                   "application/json"})
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if attempt == 2:
+                    raise
+        self._release(scheme, netloc, conn)
+
+        if resp.status == 404:
+            return None
+        if resp.status != 200:
+            raise IOError("{0} returned {1}".format(url, resp.status))
+
+        return json.loads(body)
+
+
+class TVMazeProvider(HTTPProvider):
+    """ TVmaze, returns every episode of a show in a single request """
+    name = "tvmaze"
+
+    def __init__(self, base_url="http://api.tvmaze.com", interval=0.5,
+                 timeout=10):
+        HTTPProvider.__init__(self, base_url, interval, timeout)
+
+    def titles(self, show):
+        data = self.get_json("/singlesearch/shows",
+                             {"q": show, "embed": "episodes"})
+        if not data:
+            return None
+
+        titles = {}
+        for e in data.get("_embedded", {}).get("episodes", []):
+            if e.get("season") != None and e.get("number") != None:
+                titles[(e["season"], e["number"])] = e.get("name") or ""
+
+        return titles
+
+
+PROVIDERS = {"tvmaze": TVMazeProvider}
+
+
+class TitleCache:
+    """ SQLite store of provider results that expire after ttl seconds """
+
+    def __init__(self, path, ttl=7 * 86400):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.execute("""CREATE TABLE IF NOT EXISTS titles (
+                               provider TEXT, show TEXT, data TEXT,
+                               fetched INTEGER,
+                               PRIMARY KEY (provider, show))""")
+        self.db.commit()
+
+    def get(self, provider, show):
+        """ Returns the cached titles, None for a show the provider did not
+            know, or False when there is nothing fresh cached """
+        with self.lock:
+            row = self.db.execute("""SELECT data FROM titles WHERE
+                                     provider = ? AND show = ? AND
+                                     fetched > ?""",
+                                  (provider, show, time.time() - self.ttl))
+            row = row.fetchone()
+        if not row:
+            return False
+
+        data = json.loads(row[0])
+        if data == None:
+            return None
+        return dict(((s, e), t) for s, e, t in data)
+
+    def put(self, provider, show, titles):
+        if titles != None:
+            data = [(s, e, t) for (s, e), t in titles.iteritems()]
+        else:
+            data = None
+
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?)",
+                            (provider, show, json.dumps(data),
+                             int(time.time())))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class TitleLookup:
+    """ Fetches titles for many shows at once, each show only once. The
+        worker threads are started on the first fetch and kept until
+        close(). """
+
+    def __init__(self, provider, cache=None, workers=4):
+        self.provider = provider
+        self.cache = cache
+        self.workers = workers
+        self._pool = None
+
+    def _fetch(self, show):
+        try:
+            titles = self.provider.titles(show)
+        except (IOError, ValueError, httplib.HTTPException, socket.error), e:
+            LOG.info("Cannot look up {0} - {1}".format(show, e))
+            return show, None, False
+
+        return show, titles, True
+
+    def fetch(self, shows):
+        """ Returns {show: {(season, episode): title} or None} """
+        found = {}
+        missing = []
+
+        for show in set(shows):
+            titles = self.cache.get(self.provider.name, show) \
+                if self.cache else False
+            if titles == False:
+                missing.append(show)
+            else:
+                found[show] = titles
+
+        if not missing:
+            return found
+
+        if not self._pool:
+            self._pool = ThreadPool(self.workers)
+        for show, titles, ok in self._pool.imap_unordered(self._fetch,
+                                                          missing):
+            found[show] = titles
+            if ok and self.cache:
+                self.cache.put(self.provider.name, show, titles)
+
+        return found
+
+    def close(self):
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self.provider.close()
+        if self.cache:
+            self.cache.close()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+On disk cache of parse results.
+
+Results are keyed by the filename and a hash of the options that were in
+effect when it was parsed, so changing any of those simply misses the
+cache rather than returning stale names.
+"""
+
+import sqlite3
+import time
+
+# SQLite limits the number of parameters in a single statement
+_BATCH = 500
+
+
+class ParseCache:
+    """
+    SQLite backed store of FileObject values, FileObject.parsed() tuples of
+    FIELDS.
+
+    Entries not used recently are evicted on close() once the cache holds
+    more than max_entries.
+    """
+    FIELDS = ("show_name", "season", "episode", "episode_name", "new_name")
+
+    def __init__(self, path, max_entries=200000):
+        self.max_entries = max_entries
+        self.used = int(time.time())
+        # Used from the parse stage's thread, one thread at a time
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # Filenames are byte strings and not always valid UTF-8
+        self.db.text_factory = str
+        self.db.execute("""CREATE TABLE IF NOT EXISTS parses (
+                               name TEXT, options TEXT,
+                               show_name TEXT, season TEXT, episode TEXT,
+                               episode_name TEXT, new_name TEXT,
+                               success INTEGER, used INTEGER,
+                               PRIMARY KEY (name, options))""")
+        self.db.execute("""CREATE INDEX IF NOT EXISTS parses_used
+                           ON parses (used)""")
+        self.db.commit()
+
+    def lookup(self, names, options):
+        """ Returns {name: (values, success)} for the names in the cache """
+        found = {}
+        names = list(set(names))
+
+        for i in range(0, len(names), _BATCH):
+            chunk = names[i:i + _BATCH]
+            rows = self.db.execute(
+                "SELECT name, " + ", ".join(self.FIELDS) + ", success "
+                "FROM parses WHERE options = ? AND name IN (" +
+                ", ".join("?" * len(chunk)) + ")", [options] + chunk)
+
+            for row in rows:
+                found[row[0]] = (row[1:-1], bool(row[-1]))
+
+        if found:
+            self.db.executemany(
+                "UPDATE parses SET used = ? WHERE name = ? AND options = ?",
+                [(self.used, n, options) for n in found])
+            self.db.commit()
+
+        return found
+
+    def store(self, records, options):
+        """ records is a list of (name, values, success) """
+        self.db.executemany(
+            "INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(n, options) + tuple(v) + (int(ok), self.used)
+             for n, v, ok in records])
+        self.db.commit()
+
+    def evict(self):
+        count = self.db.execute("SELECT COUNT(*) FROM parses").fetchone()[0]
+
+        if count > self.max_entries:
+            self.db.execute("""DELETE FROM parses WHERE rowid IN
+                               (SELECT rowid FROM parses
+                                ORDER BY used LIMIT ?)""",
+                            (count - self.max_entries,))
+            self.db.commit()
+
+    def close(self):
+        self.evict()
+        self.db.close()
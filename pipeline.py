@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Running the stages of a run side by side.
+
+A run is a chain of generators, scan feeding parse feeding relocation.
+Chained directly they take turns on one thread, so the disks sit idle
+while names are parsed and parsing waits on every copy. A Stage runs a
+generator on a thread of its own and hands what it yields to the next
+stage through a bounded queue. It can get ahead by that many items and
+no more, then it waits for the stage after it to catch up.
+
+Items are handed over in chunks, as every hand over between threads has
+to pass the interpreter lock back and forth. A chunk goes as soon as the
+next stage has nothing left, so the first items are not held up.
+"""
+
+import sys
+import threading
+import Queue
+
+_END = object()
+
+
+class _Failed:
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class Stage:
+    """
+    Iterable of the items of iterable, which is run on its own thread at
+    most size items ahead of whoever is iterating. Exceptions raised by
+    iterable are raised again from the iteration. Counts of the times the
+    consumer found nothing ready (starved) and the producer found the
+    queue full (blocked) are kept to show which side is the slower.
+    """
+
+    def __init__(self, iterable, size=1000, name=None, chunk=50):
+        self.iterable = iterable
+        self.size = max(1, size)
+        self.name = name
+        self.chunk = max(1, min(chunk, self.size))
+        self.starved = 0
+        self.blocked = 0
+        self._queue = Queue.Queue(max(1, self.size // self.chunk))
+        self._stop = False
+
+    def _put(self, items):
+        if self._queue.full():
+            self.blocked += 1
+        self._queue.put(items)
+
+    def _produce(self):
+        items = []
+        try:
+            for item in self.iterable:
+                items.append(item)
+                if len(items) >= self.chunk or self._queue.empty():
+                    self._put(items)
+                    items = []
+                if self._stop:
+                    return
+            items.append(_END)
+        except BaseException:
+            items.append(_Failed(sys.exc_info()))
+        self._put(items)
+
+    def __iter__(self):
+        t = threading.Thread(target=self._produce, name=self.name)
+        t.daemon = True
+        t.start()
+
+        try:
+            while True:
+                if self._queue.empty():
+                    self.starved += 1
+                for item in self._queue.get():
+                    if item is _END:
+                        return
+                    if isinstance(item, _Failed):
+                        raise item.exc_info[0], item.exc_info[1], \
+                              item.exc_info[2]
+                    yield item
+        finally:
+            # Stopped early, let the producer finish its put and see it
+            self._stop = True
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except Queue.Empty:
+                    break
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+"""
+Relocation of files, scheduling across devices and the link based
+alternatives to copying.
+
+Jobs are grouped by the devices of their source and destination so
+transfers between different pairs of disks overlap while each pair only
+has as many workers as it can take without thrashing.
+
+What is already at the destination is kept in memory so each destination
+directory is listed once instead of every file costing a stat, which is a
+round trip each on network filesystems.
+
+Copies are made by ResumableCopier, in large chunks inside the kernel
+where it can, into a temporary file that an interrupted copy picks up
+from again.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import shutil
+import threading
+import time
+import Queue
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOG = logging.getLogger()
+
+# Linux ioctl to share the extents of one file with another (btrfs, XFS)
+FICLONE = 0x40049409
+
+# Errors meaning a link cannot be made here but a copy would work
+_FALLBACK_ERRNOS = set([errno.EXDEV, errno.EPERM, errno.EINVAL,
+                        errno.ENOTTY, errno.ENOSYS, errno.EOPNOTSUPP,
+                        getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)])
+
+
+def hardlink(src, dst):
+    os.link(src, dst)
+
+
+def symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+
+def reflink(src, dst):
+    """ Copy on write clone of src, only the metadata is written """
+    if not fcntl:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported here")
+
+    with open(src, "rb") as s:
+        with open(dst, "wb") as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except (IOError, OSError), e:
+                os.remove(dst)
+                raise OSError(e.errno, e.strerror)
+
+    shutil.copymode(src, dst)
+
+
+# Loaded the first time a copy is made, finding it runs ldconfig
+_LIBC = {}
+
+
+def _libc():
+    if "libc" not in _LIBC:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        except OSError:
+            libc = None
+        for name in ("copy_file_range", "sendfile64"):
+            if libc and hasattr(libc, name):
+                getattr(libc, name).restype = ctypes.c_ssize_t
+        _LIBC["libc"] = libc
+    return _LIBC["libc"]
+
+# Errors meaning a kernel side copy cannot be used for these two files
+_USERSPACE_ERRNOS = set([errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                         errno.EOPNOTSUPP, errno.EBADF,
+                         getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)])
+
+
+def _copy_file_range(src, dst, offset, count):
+    libc = _libc()
+    if not libc or not hasattr(libc, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+
+    off_in = ctypes.c_int64(offset)
+    off_out = ctypes.c_int64(offset)
+    n = libc.copy_file_range(src, ctypes.byref(off_in), dst,
+                             ctypes.byref(off_out), ctypes.c_size_t(count), 0)
+    if n < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return n
+
+
+def _sendfile(src, dst, offset, count):
+    libc = _libc()
+    if not libc or not hasattr(libc, "sendfile64"):
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+
+    # sendfile writes at the current position of dst
+    os.lseek(dst, offset, os.SEEK_SET)
+    off = ctypes.c_int64(offset)
+    n = libc.sendfile64(dst, src, ctypes.byref(off), ctypes.c_size_t(count))
+    if n < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return n
+
+
+def _read_write(src, dst, offset, count):
+    os.lseek(src, offset, os.SEEK_SET)
+    os.lseek(dst, offset, os.SEEK_SET)
+    data = os.read(src, count)
+    written = 0
+    while written < len(data):
+        written += os.write(dst, data[written:])
+    return len(data)
+
+
+class ResumableCopier:
+    """
+    Copies files in chunks of chunk_size bytes, trying copy_file_range,
+    then sendfile and then plain reads and writes.
+
+    The copy is made in a hidden temporary file next to the destination.
+    After each chunk is synced to disk a checkpoint records how far it
+    got, so a copy that was interrupted carries on from there as long as
+    the source has not changed. The finished file is renamed into place.
+
+    copy() and move() can be used anywhere shutil.copy and shutil.move
+    are. Totals across every file are kept for summary().
+    """
+    METHODS = (_copy_file_range, _sendfile, _read_write)
+
+    def __init__(self, chunk_size=64 * 1024 * 1024):
+        # Whole megabytes keep every chunk aligned for the filesystem
+        self.chunk_size = max(1, chunk_size >> 20) << 20
+        self.files = 0
+        self.bytes = 0
+        self.resumed = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _partial(dst):
+        d, name = os.path.split(dst)
+        part = os.path.join(d, "." + name + ".fix_nums-part")
+        return part, part + ".ckpt"
+
+    def _resume_at(self, part, checkpoint, st):
+        """ Offset to carry on copying from, 0 to start again """
+        try:
+            with open(checkpoint) as f:
+                size, mtime, offset = f.read().split()
+            if (int(size), mtime) != (st.st_size, repr(st.st_mtime)):
+                return 0
+            offset = int(offset)
+            if os.path.getsize(part) < offset:
+                return 0
+        except (IOError, OSError, ValueError):
+            return 0
+        return offset
+
+    def _checkpoint(self, checkpoint, st, offset):
+        tmp = checkpoint + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("{0} {1} {2}\n".format(st.st_size, repr(st.st_mtime),
+                                           offset))
+        os.rename(tmp, checkpoint)
+
+    def copy(self, src, dst):
+        """ Copies src to dst along with its permission bits, returns the
+            number of bytes copied this time """
+        part, checkpoint = self._partial(dst)
+        start = time.time()
+
+        fin = os.open(src, os.O_RDONLY)
+        try:
+            st = os.fstat(fin)
+            offset = self._resume_at(part, checkpoint, st)
+            if offset:
+                LOG.info("Resuming {0} at {1:.1f} MB".format(dst, offset / 1e6))
+            fout = os.open(part, os.O_WRONLY | os.O_CREAT, 0666)
+            try:
+                os.ftruncate(fout, offset)
+                resumed_at = offset
+                method = 0
+                while offset < st.st_size:
+                    count = min(self.chunk_size, st.st_size - offset)
+                    try:
+                        n = self.METHODS[method](fin, fout, offset, count)
+                    except OSError, e:
+                        if (e.errno not in _USERSPACE_ERRNOS or
+                                method == len(self.METHODS) - 1):
+                            raise
+                        method += 1
+                        continue
+                    if n == 0:
+                        raise IOError(errno.EIO, "{0} ended early".format(src))
+                    offset += n
+                    # Data has to be on disk before the checkpoint says so
+                    os.fsync(fout)
+                    self._checkpoint(checkpoint, st, offset)
+            finally:
+                os.close(fout)
+        finally:
+            os.close(fin)
+
+        shutil.copymode(src, part)
+        os.rename(part, dst)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        took = time.time() - start
+        copied = st.st_size - resumed_at
+        with self._lock:
+            self.files += 1
+            self.bytes += copied
+            self.seconds += took
+            if resumed_at:
+                self.resumed += 1
+
+        # Small files such as subtitles are not worth a line each
+        level = logging.INFO if st.st_size >= self.chunk_size else \
+            logging.DEBUG
+        LOG.log(level, "Copied {0} | {1:.1f} MB in {2:.1f}s ({3:.1f} MB/s)"
+                .format(dst, copied / 1e6, took,
+                        copied / 1e6 / took if took else 0))
+        return copied
+
+    def move(self, src, dst):
+        """ Renames src to dst, copying and then removing src when they are
+            on different devices """
+        try:
+            os.rename(src, dst)
+            return
+        except OSError, e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        self.copy(src, dst)
+        shutil.copystat(src, dst)
+        os.unlink(src)
+
+    def reset(self):
+        with self._lock:
+            self.files = self.bytes = self.resumed = 0
+            self.seconds = 0.0
+
+    def summary(self):
+        """ Lines describing every copy made since the last reset() """
+        if not self.files:
+            return []
+
+        line = "Copied {0} files, {1:.1f} MB in {2:.1f}s ({3:.1f} MB/s)".format(
+               self.files, self.bytes / 1e6, self.seconds,
+               self.bytes / 1e6 / self.seconds if self.seconds else 0)
+        if self.resumed:
+            line += ", {0} resumed".format(self.resumed)
+        return [line]
+
+
+def with_fallback(link, name, fallback=shutil.copy):
+    """
+    Wraps one of the link functions so anything that cannot be linked,
+    usually because it is on a different device, is copied instead.
+    An existing destination is replaced, the same as a copy would do.
+    """
+    def relocate(src, dst):
+        try:
+            try:
+                link(src, dst)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                os.remove(dst)
+                link(src, dst)
+        except OSError, e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            LOG.info("{0} {1} -> {2} | {3}, copying instead".format(
+                     name, src, dst, e.strerror))
+            fallback(src, dst)
+
+    return relocate
+
+
+class DestinationIndex:
+    """
+    Names in destination directories. A directory is listed the first time
+    it is asked about and answered from memory after that, directories
+    created through make_dirs() are known to be empty.
+
+    Paths that change on disk behind its back are not noticed, clear() it
+    to start over. Destinations claimed by a run are kept the same way, a
+    set of names per directory, so a long run does not hold every full
+    path it has relocated to.
+    """
+
+    def __init__(self):
+        # Directory -> set of names, None if it does not exist
+        self._dirs = {}
+        # Directories listed since the last clear()
+        self.listings = 0
+        # Directory -> set of names claimed
+        self._claims = {}
+        self._lock = threading.Lock()
+
+    def _names(self, d):
+        names = self._dirs.get(d, False)
+        if names is False:
+            self.listings += 1
+            try:
+                names = set(os.listdir(d))
+            except OSError:
+                names = None
+            self._dirs[d] = names
+        return names
+
+    def isdir(self, path):
+        with self._lock:
+            return self._names(os.path.abspath(path)) != None
+
+    def exists(self, path):
+        d, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            names = self._names(d)
+            return names != None and name in names
+
+    def make_dirs(self, path):
+        """ Creates path and any missing parents, returns False if it
+            already existed """
+        path = os.path.abspath(path)
+        if self.isdir(path):
+            return False
+
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        with self._lock:
+            self._dirs[path] = set()
+            # Parents that were listed need to hear about their new children
+            child = path
+            parent = os.path.dirname(child)
+            while parent != child:
+                names = self._dirs.get(parent, False)
+                if names is False:
+                    break
+                existed = names != None
+                if not existed:
+                    self._dirs[parent] = names = set()
+                names.add(os.path.basename(child))
+                if existed:
+                    break
+                child, parent = parent, os.path.dirname(parent)
+
+        return True
+
+    def add(self, path):
+        d, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            names = self._dirs.get(d)
+            if names != None:
+                names.add(name)
+
+    def discard(self, path):
+        d, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            names = self._dirs.get(d)
+            if names != None:
+                names.discard(name)
+
+    def claimed(self, path):
+        d, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            return name in self._claims.get(d, ())
+
+    def claim(self, path):
+        d, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            self._claims.setdefault(d, set()).add(name)
+
+    def clear(self):
+        with self._lock:
+            self._dirs.clear()
+            self._claims.clear()
+            self.listings = 0
+
+
+class RelocationScheduler:
+    """
+    Runs relocation jobs on worker threads, one pool per device pair.
+
+    relocate is called as relocate(src, dst) and should return True on
+    success. Jobs for a device pair run in the order they were submitted
+    when there is a single worker per pair. Once backlog jobs are waiting
+    for a pair submit() blocks, so jobs are taken no faster than they can
+    be run. A job that raises is logged and counted as failed, the worker
+    goes on with the next.
+    """
+
+    def __init__(self, relocate, workers=1, backlog=1000):
+        self.relocate = relocate
+        self.workers = max(1, workers)
+        self.backlog = backlog
+        self._queues = {}
+        self._threads = []
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def submit(self, src, dst, size, key, *args):
+        """ key is a (source device, destination device) tuple, any other
+            arguments are passed on to relocate after src and dst """
+        if key not in self._queues:
+            q = Queue.Queue(self.backlog)
+            self._queues[key] = q
+            if key not in self._stats:
+                self._stats[key] = {"files": 0, "bytes": 0, "failed": 0,
+                                    "start": None, "end": None}
+
+            for _ in range(self.workers):
+                t = threading.Thread(target=self._work, args=(key, q))
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+        self._queues[key].put((src, dst, size, args))
+
+    def join(self):
+        """ Waits for every submitted job to finish """
+        for q in self._queues.values():
+            for _ in range(self.workers):
+                q.put(None)
+
+        for t in self._threads:
+            t.join()
+
+        self._threads = []
+        self._queues = {}
+
+    def summary(self):
+        """ Returns a line describing the throughput of each device pair """
+        lines = []
+
+        for key in sorted(self._stats):
+            s = self._stats[key]
+            if not s["files"] and not s["failed"]:
+                continue
+
+            secs = max(s["end"] - s["start"], 1e-6)
+            mb = s["bytes"] / 1048576.0
+            line = "Device {0} -> {1} | {2} files, {3:.1f} MB in {4:.1f}s " \
+                   "({5:.1f} MB/s)".format(key[0], key[1], s["files"], mb,
+                                           secs, mb / secs)
+            if s["failed"]:
+                line += ", {0} failed".format(s["failed"])
+            lines.append(line)
+
+        return lines
+
+    def _work(self, key, q):
+        stats = self._stats[key]
+
+        while True:
+            job = q.get()
+            if job == None:
+                return
+
+            src, dst, size, args = job
+            start = time.time()
+            try:
+                ok = self.relocate(src, dst, *args)
+            except Exception:
+                # A dead worker would leave submit() and join() waiting on
+                # its queue for ever
+                LOG.exception("Cannot relocate {0} -> {1}".format(src, dst))
+                ok = False
+            end = time.time()
+
+            with self._lock:
+                if stats["start"] == None or start < stats["start"]:
+                    stats["start"] = start
+                stats["end"] = max(stats["end"], end)
+                if ok:
+                    stats["files"] += 1
+                    stats["bytes"] += size
+                else:
+                    stats["failed"] += 1
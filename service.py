@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+Resident rename service for download client hooks.
+
+fix_nums.py --serve listens on a Unix domain socket so a hook does not pay
+for starting the interpreter and compiling the patterns for every job.
+Each connection sends one job as a line of JSON,
+
+    {"cwd": "/where/the/hook/ran", "argv": ["-R", "/downloads/Show.S01E01"]}
+
+and gets a line of JSON back, {"results": [[action, source, destination,
+outcome], ...]} or {"error": message}. Jobs arriving together that share a
+key, the same options from the same directory for fix_nums, are handed
+over as one batch.
+
+Run this module as the client in place of fix_nums.py,
+
+    python service.py [--socket PATH] [fix_nums options] [files]
+
+It sends its arguments and working directory to the service listening at
+PATH, ~/.fix_nums.sock by default, and prints the results. When no service
+is listening fix_nums.py is run in this process instead.
+"""
+
+import collections
+import errno
+import json
+import logging
+import os
+import Queue
+import socket
+import SocketServer
+import sys
+import threading
+import time
+
+LOG = logging.getLogger()
+
+SOCKET = os.path.expanduser("~/.fix_nums.sock")
+# Seconds to wait for more jobs after one arrives, and the most to wait
+WINDOW = 0.1
+LONGEST = 2.0
+
+
+def _encode(x):
+    """ json gives unicode, paths and options are handled as UTF-8 str """
+    if isinstance(x, unicode):
+        return x.encode("utf-8")
+    if isinstance(x, list):
+        return [_encode(i) for i in x]
+    if isinstance(x, dict):
+        return dict((_encode(k), _encode(v)) for k, v in x.iteritems())
+    return x
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            job = _encode(json.loads(self.rfile.readline()))
+            reply = self.server.service.submit(job)
+        except ValueError, e:
+            reply = {"error": "Bad job - {0}".format(e)}
+        self.wfile.write(json.dumps(reply) + "\n")
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class RenameService:
+    """
+    Hands jobs sent to the Unix socket at address to handle(jobs), which
+    returns a reply for each. Jobs with the same key(job) arriving within
+    window seconds of each other, and of no more than longest seconds
+    after the first, form one batch. Batches are handled one at a time on
+    the thread calling serve_forever().
+    """
+
+    def __init__(self, address, key, handle, window=WINDOW, longest=LONGEST):
+        self.address = address
+        self.key = key
+        self.handle = handle
+        self.window = window
+        self.longest = longest
+        self.jobs = 0
+        self.batches = 0
+        self._queue = Queue.Queue()
+
+    def submit(self, job):
+        """ Queues job and waits for its reply """
+        try:
+            key = self.key(job)
+        except Exception, e:
+            return {"error": str(e)}
+
+        waiting = [job, key, threading.Event(), None]
+        self._queue.put(waiting)
+        waiting[2].wait()
+        return waiting[3]
+
+    def _listen(self):
+        if os.path.exists(self.address):
+            # Left behind by a service that did not shut down cleanly
+            if client_socket(self.address):
+                raise socket.error(errno.EADDRINUSE, "A service is already "
+                                   "listening at {0}".format(self.address))
+            os.unlink(self.address)
+
+        # Created without access for anyone else, there is no moment
+        # between bind() and a chmod() when others could connect
+        umask = os.umask(0177)
+        try:
+            server = _Server(self.address, _Handler)
+        finally:
+            os.umask(umask)
+        server.service = self
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        return server
+
+    def _collect(self):
+        """ Waits for a job, then for those arriving close behind it """
+        while True:
+            # A timeout keeps the wait interruptible
+            try:
+                waiting = [self._queue.get(timeout=1.0)]
+                break
+            except Queue.Empty:
+                pass
+
+        end = time.time() + self.longest
+        while True:
+            timeout = min(self.window, end - time.time())
+            if timeout <= 0:
+                break
+            try:
+                waiting.append(self._queue.get(timeout=timeout))
+            except Queue.Empty:
+                break
+
+        batches = collections.OrderedDict()
+        for w in waiting:
+            batches.setdefault(w[1], []).append(w)
+        return batches.values()
+
+    def _run(self, batch):
+        try:
+            replies = self.handle([w[0] for w in batch])
+        except Exception, e:
+            LOG.exception("Batch failed")
+            replies = [{"error": str(e)}] * len(batch)
+
+        for w, reply in zip(batch, replies):
+            w[3] = reply
+            w[2].set()
+
+    def serve_forever(self):
+        server = self._listen()
+        LOG.info("Listening on {0}".format(self.address))
+        try:
+            while True:
+                for batch in self._collect():
+                    self.jobs += len(batch)
+                    self.batches += 1
+                    self._run(batch)
+        except KeyboardInterrupt:
+            LOG.info("Stopped after {0} jobs in {1} batches".format(
+                     self.jobs, self.batches))
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.unlink(self.address)
+
+
+def client_socket(address):
+    """ A socket connected to the service at address, None if there is no
+        service listening there """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(address)
+    except socket.error, e:
+        s.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+    return s
+
+
+def request(s, argv, cwd=None):
+    """ Sends a job to the service connected to s and returns its reply """
+    f = s.makefile("rwb")
+    f.write(json.dumps({"cwd": cwd or os.getcwd(), "argv": argv}) + "\n")
+    f.flush()
+    reply = f.readline()
+    f.close()
+    s.close()
+    if not reply:
+        return {"error": "The service closed the connection"}
+    return json.loads(reply)
+
+
+def main(argv=None):
+    if argv == None:
+        argv = sys.argv[1:]
+
+    # Both forms getopt accepts, options end at "--"
+    address = SOCKET
+    for i, a in enumerate(argv):
+        if a == "--":
+            break
+        if a.startswith("--socket="):
+            address = a.split("=", 1)[1]
+        elif a == "--socket" and i + 1 < len(argv):
+            address = argv[i + 1]
+
+    s = client_socket(address)
+    if not s:
+        import fix_nums
+        fix_nums.main(argv)
+        return 0
+
+    reply = request(s, argv)
+    if "error" in reply:
+        print >> sys.stderr, reply["error"]
+        return 1
+
+    failed = 0
+    for action, src, dst, outcome in reply["results"]:
+        print "{0} {1} -> {2} | {3}".format(action, src, dst or "-", outcome)
+        if outcome == "failed":
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Index of known show names for correcting misspelled ones.
+
+Names are broken into trigrams with an inverted index from each trigram to
+the shows containing it, so a lookup only scores shows sharing at least
+one trigram with the name instead of comparing against every show.
+"""
+
+import os
+import re
+import sqlite3
+
+_NON_ALNUM = re.compile("[\W_]+")
+
+
+def normalize(name):
+    return _NON_ALNUM.sub(" ", name.lower()).strip()
+
+
+def trigrams(key):
+    s = "  " + key + " "
+    return set(s[i:i + 3] for i in range(len(s) - 2))
+
+
+class ShowIndex:
+    """
+    Trigram index of show names, persisted to a SQLite table.
+
+    Names are stored in the form FileObject uses before capitalizing, lower
+    case words separated by spaces. Similarity is the Dice coefficient of
+    the two names' trigrams, 1.0 being identical.
+    """
+
+    def __init__(self, path=None):
+        self.names = []
+        self.keys = {}
+        self.sizes = []
+        self.postings = {}
+        self.db = None
+
+        if path:
+            self.db = sqlite3.connect(path)
+            self.db.text_factory = str
+            self.db.execute("""CREATE TABLE IF NOT EXISTS shows
+                               (name TEXT PRIMARY KEY)""")
+            self.db.commit()
+            for (name,) in self.db.execute("SELECT name FROM shows"):
+                self._index(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _index(self, name):
+        key = normalize(name)
+        if not key or key in self.keys:
+            return False
+
+        i = len(self.names)
+        self.names.append(name)
+        self.keys[key] = i
+        grams = trigrams(key)
+        self.sizes.append(len(grams))
+        for g in grams:
+            self.postings.setdefault(g, []).append(i)
+
+        return True
+
+    def add(self, name):
+        """ Adds a show, returns False if it was already known """
+        if not self._index(name):
+            return False
+
+        if self.db:
+            self.db.execute("INSERT OR IGNORE INTO shows VALUES (?)", (name,))
+            self.db.commit()
+        return True
+
+    def add_dir(self, path, delim=" "):
+        """ Adds each directory in path as a show, for a library laid out
+            as show_name/season/... with words separated by delim """
+        try:
+            dirs = os.listdir(path)
+        except OSError:
+            return 0
+
+        added = 0
+        for d in dirs:
+            if d.startswith(".") or not os.path.isdir(os.path.join(path, d)):
+                continue
+            name = d.replace(delim, " ").lower() if delim else d.lower()
+            if self._index(name):
+                added += 1
+                if self.db:
+                    self.db.execute("INSERT OR IGNORE INTO shows VALUES (?)",
+                                    (name,))
+
+        if self.db:
+            self.db.commit()
+        return added
+
+    def lookup(self, name, threshold):
+        """ Returns (show, similarity) for the closest known show or None
+            if no show is at least threshold similar """
+        key = normalize(name)
+        if key in self.keys:
+            return self.names[self.keys[key]], 1.0
+
+        grams = trigrams(key)
+        counts = {}
+        for g in grams:
+            for i in self.postings.get(g, ()):
+                counts[i] = counts.get(i, 0) + 1
+
+        best, score = None, threshold
+        n = len(grams)
+        for i, c in counts.iteritems():
+            s = 2.0 * c / (n + self.sizes[i])
+            if s > score or (s == score and best == None):
+                best, score = i, s
+
+        if best == None:
+            return None
+        return self.names[best], score
+
+    def close(self):
+        if self.db:
+            self.db.close()
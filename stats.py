@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Run statistics for --stats.
+
+Time is charged to the innermost phase running on the calling thread, so
+a phase pulling files through another (parse pulling from scan) is only
+charged for its own work. Every thread keeps its own stack of phases, so
+scanning and parsing on pipeline stages and relocation on worker threads
+are timed too. Phases on different threads overlap, their times can add
+up to more than the wall time. Only the main thread's phases are taken
+from the wall time to give "other". Nothing here is touched unless
+--stats is given.
+"""
+
+import threading
+import time
+
+
+class Stats:
+    """ Wall time per phase and named counts for one run """
+
+    def __init__(self):
+        self.phases = {}
+        self.counts = {}
+        self.started = time.time()
+        self.finished = None
+        # Phase time charged on the main thread
+        self.main = 0.0
+        self._main = threading.current_thread()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _charge(self, now):
+        # The calling thread's [stack of phases, time last charged]
+        state = self._local.__dict__.setdefault("state", [[], now])
+        stack, mark = state
+        if stack:
+            name = stack[-1]
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + now - mark
+                if threading.current_thread() is self._main:
+                    self.main += now - mark
+        state[1] = now
+        return stack
+
+    def start(self, phase):
+        self._charge(time.time()).append(phase)
+
+    def stop(self):
+        self._charge(time.time()).pop()
+
+    def timed(self, phase, iterable):
+        """ Generator charging the time taken to produce each item of
+            iterable to phase """
+        it = iter(iterable)
+        while True:
+            self.start(phase)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def finish(self):
+        self.finished = time.time()
+
+    def wall(self):
+        return (self.finished or time.time()) - self.started
+
+    def as_dict(self, patterns=()):
+        """ Everything recorded, patterns being a list of per pattern
+            dicts to include """
+        wall = self.wall()
+        files = (self.counts.get("relocated", 0) or
+                 self.counts.get("planned", 0))
+        size = self.counts.get("bytes", 0)
+        return {"wall": wall,
+                "phases": dict(self.phases),
+                "main": self.main,
+                "counts": dict(self.counts),
+                "patterns": list(patterns),
+                "files_per_second": files / wall if wall else 0.0,
+                "mb_per_second": size / 1e6 / wall if wall else 0.0}
+
+    def report(self, patterns=()):
+        """ Lines summarising the run """
+        d = self.as_dict(patterns)
+        wall = d["wall"]
+        lines = ["Wall time {0:.3f}s | {1:.1f} files/s, {2:.2f} MB/s".format(
+                 wall, d["files_per_second"], d["mb_per_second"])]
+
+        phases = sorted(d["phases"].items(), key=lambda p: -p[1])
+        phases.append(("other", max(0.0, wall - d["main"])))
+        for name, took in phases:
+            lines.append("  {0:<10} {1:>9.3f}s {2:>6.1%}".format(
+                         name, took, took / wall if wall else 0))
+
+        for name, n in sorted(d["counts"].items()):
+            lines.append("  {0:<20} {1:>10}".format(name, n))
+
+        for p in d["patterns"]:
+            lines.append("  pattern {0:<3} tried {1:>8}, matched {2:>8}"
+                         .format(p["pattern"], p["tried"], p["matched"]))
+
+        return lines
@@ -0,0 +1,78 @@
+"""
+Tests for fix_nums, run from the top of the tree with
+
+    python -m unittest discover
+
+Most run fix_nums.py as a script, as the readme has it, against an inbox
+and a library in a temporary directory that is also HOME, so the caches,
+journal and manifest of a test are its own. See ScriptTest.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "fix_nums.py")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+class ScriptTest(unittest.TestCase):
+    """ Runs fix_nums.py from an inbox directory, HOME being a temporary
+        directory holding the inbox and library """
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.inbox = os.path.join(self.home, "in")
+        self.lib = os.path.join(self.home, "lib")
+        os.mkdir(self.inbox)
+        os.mkdir(self.lib)
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def make(self, name, data="x", root=None):
+        """ Writes data to name under root, the inbox by default """
+        path = os.path.join(root or self.inbox, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def fix_nums(self, *argv, **kwargs):
+        """ Output of running fix_nums.py with argv in the inbox """
+        env = dict(os.environ, HOME=self.home)
+        p = subprocess.Popen([sys.executable, SCRIPT] + list(argv),
+                             cwd=kwargs.get("cwd", self.inbox), env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = p.communicate()[0]
+        if p.returncode and not kwargs.get("fails"):
+            self.fail("fix_nums.py {0} exited with {1}\n{2}".format(
+                      " ".join(argv), p.returncode, out))
+        return out
+
+    def stats(self, *argv):
+        """ The --stats-json figures of a run with argv """
+        path = os.path.join(self.home, "stats.json")
+        self.fix_nums(*argv + ("--stats-json", path))
+        with open(path) as f:
+            return json.load(f)
+
+    def files(self, root=None):
+        """ Sorted paths of the files under root, the library by default,
+            relative to it """
+        root = root or self.lib
+        found = []
+        for d, dirs, names in os.walk(root):
+            for n in names:
+                found.append(os.path.relpath(os.path.join(d, n), root))
+        return sorted(found)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
@@ -0,0 +1,66 @@
+import errno
+import os
+import time
+
+from tests import ScriptTest
+import relocate
+
+MB = 1024 * 1024
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _interrupt_after(chunks):
+    """ A copy method that copies chunks chunks and then fails """
+    left = [chunks]
+
+    def copy(src, dst, offset, count):
+        if not left[0]:
+            raise _Interrupted()
+        left[0] -= 1
+        return relocate._read_write(src, dst, offset, count)
+    return copy
+
+
+def _unavailable(src, dst, offset, count):
+    raise OSError(errno.ENOSYS, "not here")
+
+
+class ResumableCopyTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        self.data = os.urandom(3 * MB + 100)
+        self.src = self.make("a.mkv", self.data)
+        self.dst = os.path.join(self.lib, "b.mkv")
+
+    def interrupted(self, chunks):
+        copier = relocate.ResumableCopier(MB)
+        copier.METHODS = (_interrupt_after(chunks),)
+        self.assertRaises(_Interrupted, copier.copy, self.src, self.dst)
+        self.assertFalse(os.path.exists(self.dst))
+
+    def test_resumed(self):
+        self.interrupted(2)
+        copier = relocate.ResumableCopier(MB)
+        self.assertEqual(copier.copy(self.src, self.dst), MB + 100)
+        self.assertEqual(copier.resumed, 1)
+        self.assertEqual(self.read(self.dst), self.data)
+        self.assertEqual(self.files(), ["b.mkv"])
+
+    def test_started_again_when_source_changed(self):
+        self.interrupted(2)
+        os.utime(self.src, (time.time() + 10, time.time() + 10))
+        copier = relocate.ResumableCopier(MB)
+        self.assertEqual(copier.copy(self.src, self.dst), len(self.data))
+        self.assertEqual(copier.resumed, 0)
+        self.assertEqual(self.read(self.dst), self.data)
+
+    def test_falls_back_to_another_method(self):
+        copier = relocate.ResumableCopier(MB)
+        copier.METHODS = (_unavailable, relocate._read_write)
+        copier.copy(self.src, self.dst)
+        self.assertEqual(self.read(self.dst), self.data)
+        self.assertEqual(self.files(), ["b.mkv"])
@@ -0,0 +1,50 @@
+import os
+
+from tests import ScriptTest
+import fix_nums
+
+
+class ShowIndexTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        self.saved = dict(fix_nums.OPTS)
+        fix_nums.OPTS["SHOWDB"] = os.path.join(self.home, "shows.db")
+        self.other = os.path.join(self.home, "other")
+        os.makedirs(os.path.join(self.lib, "South.Park"))
+        os.makedirs(os.path.join(self.other, "Breaking.Bad"))
+
+    def tearDown(self):
+        fix_nums.close_show_index()
+        fix_nums.OPTS.clear()
+        fix_nums.OPTS.update(self.saved)
+        ScriptTest.tearDown(self)
+
+    def lookup(self, library, name):
+        fix_nums.OPTS["OUTPUTDIR"] = library
+        return fix_nums.show_index().lookup(name, 0.7)
+
+    def test_reopened_for_another_library(self):
+        self.assertEqual(self.lookup(self.lib, "suth park")[0], "south park")
+        index = fix_nums.show_index()
+        self.assertEqual(self.lookup(self.other, "braking bad")[0],
+                         "breaking bad")
+        self.assertIsNot(fix_nums.show_index(), index)
+
+    def test_kept_for_the_same_library(self):
+        self.lookup(self.lib, "suth park")
+        index = fix_nums.show_index()
+        self.lookup(self.lib, "suth park")
+        self.assertIs(fix_nums.show_index(), index)
+
+    def test_closed(self):
+        self.lookup(self.lib, "suth park")
+        db = fix_nums.show_index().db
+        fix_nums.close_show_index()
+        self.assertRaises(fix_nums.sqlite3.ProgrammingError, db.execute,
+                          "SELECT 1")
+
+    def test_corrected_from_the_script(self):
+        self.make("suth.park.S01E02.mkv")
+        self.fix_nums("--correct", "--no-cache", "-o", self.lib)
+        self.assertEqual(self.files(), ["South.Park/1/South.Park.S1E02.mkv"])
@@ -0,0 +1,63 @@
+import os
+
+import journal
+from tests import ScriptTest
+
+
+class RevertTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        self.make("Some.Show.S01E01.mkv", "one")
+        self.make("Some.Show.S01E02.mkv", "two")
+        self.args = ("-R", "--no-cache", "--no-manifest", "-o", self.lib)
+
+    def test_revert_moves(self):
+        self.fix_nums(*self.args)
+        self.assertEqual(self.files(self.inbox), [])
+        self.fix_nums("--revert", "last")
+        self.assertEqual(self.files(), [])
+        self.assertEqual(self.files(self.inbox), ["Some.Show.S01E01.mkv",
+                                                  "Some.Show.S01E02.mkv"])
+        self.assertEqual(self.read(os.path.join(self.inbox,
+                                                "Some.Show.S01E02.mkv")),
+                         "two")
+
+    def test_revert_copies(self):
+        self.fix_nums(*self.args + ("-r",))
+        self.assertEqual(len(self.files()), 2)
+        self.fix_nums("--revert", "last")
+        self.assertEqual(self.files(), [])
+        self.assertEqual(len(self.files(self.inbox)), 2)
+
+    def test_revert_keeps_file_copied_over(self):
+        there = self.make("Some.Show/1/Some.Show.S1E02.mkv", "old", self.lib)
+        self.fix_nums(*self.args + ("-r", "-D"))
+        self.assertEqual(self.read(there), "two")
+        self.fix_nums("--revert", "last")
+        self.assertEqual(self.files(), ["Some.Show/1/Some.Show.S1E02.mkv"])
+
+    def test_only_last_run_reverted(self):
+        self.fix_nums(*self.args + ("Some.Show.S01E01.mkv",))
+        self.fix_nums(*self.args + ("Some.Show.S01E02.mkv",))
+        self.fix_nums("--revert", "last")
+        self.assertEqual(self.files(), ["Some.Show/1/Some.Show.S1E01.mkv"])
+
+
+class PruneTest(ScriptTest):
+
+    def test_keeps_most_recent_runs(self):
+        path = os.path.join(self.home, "journal")
+        for i in range(5):
+            j = journal.Journal(path, keep=3)
+            j.run = "run{0}".format(i)
+            j.begin("Move", "a{0}".format(i), "b{0}".format(i))
+            j.done("Move", "a{0}".format(i), "b{0}".format(i))
+            j.close()
+
+        self.assertEqual(journal.runs(path), ["run2", "run3", "run4"])
+        self.assertEqual([o[2] for o in journal.outcomes(path)],
+                         ["a2", "a3", "a4"])
+        self.assertEqual(journal.prune(path, 1), 2)
+        self.assertEqual(journal.runs(path), ["run4"])
+        self.assertFalse(os.path.exists(path + ".new"))
@@ -0,0 +1,103 @@
+import BaseHTTPServer
+import json
+import os
+import SocketServer
+import threading
+import urlparse
+
+from tests import ScriptTest
+import metadata
+
+SHOWS = {"some show": [(1, 1, "Pilot"), (1, 2, "The Second One")]}
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers like TVmaze's /singlesearch/shows, noting the client port
+        each request came from """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        show = urlparse.parse_qs(url.query).get("q", [""])[0].lower()
+        self.server.requests.append((show, self.client_address[1]))
+
+        if show in SHOWS:
+            episodes = [{"season": s, "number": e, "name": t}
+                        for s, e, t in SHOWS[show]]
+            body = json.dumps({"name": show,
+                               "_embedded": {"episodes": episodes}})
+            self.send_response(200)
+        else:
+            body = ""
+            self.send_response(404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class LookupTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.requests = []
+        self.url = "http://127.0.0.1:{0}".format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        ScriptTest.tearDown(self)
+
+    def lookup(self, ttl):
+        cache = metadata.TitleCache(os.path.join(self.home, "titles.db"), ttl)
+        provider = metadata.TVMazeProvider(self.url, interval=0)
+        return metadata.TitleLookup(provider, cache, workers=1)
+
+    def test_titles_from_lookup_url(self):
+        self.make("Some.Show.S01E02.mkv")
+        self.make("Other.Show.S01E01.mkv")
+        self.fix_nums("--lookup", "tvmaze", "--lookup-url", self.url,
+                      "--no-cache", "-o", self.lib)
+        self.assertEqual(self.files(),
+                         ["Other.Show/1/Other.Show.S1E01.mkv",
+                          "Some.Show/1/Some.Show.S1E02.The.Second.One.mkv"])
+
+    def test_connection_reused(self):
+        provider = metadata.TVMazeProvider(self.url, interval=0)
+        try:
+            for show in ("some show", "other show", "some show"):
+                provider.titles(show)
+        finally:
+            provider.close()
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(set(p for s, p in self.server.requests)), 1)
+
+    def test_cached_until_expired(self):
+        lookup = self.lookup(3600)
+        try:
+            for i in range(2):
+                titles = lookup.fetch(["some show", "other show"])
+        finally:
+            lookup.close()
+        self.assertEqual(titles["some show"][(1, 1)], "Pilot")
+        self.assertEqual(titles["other show"], None)
+        self.assertEqual(len(self.server.requests), 2)
+
+        lookup = self.lookup(-1)
+        try:
+            titles = lookup.fetch(["some show"])
+        finally:
+            lookup.close()
+        self.assertEqual(titles["some show"][(1, 2)], "The Second One")
+        self.assertEqual(len(self.server.requests), 3)
@@ -0,0 +1,56 @@
+import os
+
+from manifest import Manifest
+from tests import ScriptTest
+
+
+class ManifestTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        self.make("Some.Show.S01E01.mkv")
+        self.make("Some.Show.S01E02.mkv")
+        self.args = ("-R", "-r", "--no-cache", "-o", self.lib)
+
+    def test_settled_directory_not_listed(self):
+        self.fix_nums(*self.args)
+        s = self.stats(*self.args)
+        self.assertEqual(s["counts"].get("settled dirs"), 1)
+        self.assertNotIn("copy", s["counts"])
+
+    def test_only_new_names_looked_at(self):
+        self.fix_nums(*self.args)
+        self.make("Some.Show.S01E03.mkv")
+        s = self.stats(*self.args)
+        self.assertEqual(s["counts"].get("copy"), 1)
+        self.assertEqual(len(self.files()), 3)
+
+    def test_blocked_file_looked_at_again(self):
+        blocker = self.make("Some.Show/1/Some.Show.S1E02.mkv", "old", self.lib)
+        self.fix_nums(*self.args)
+        self.assertEqual(self.read(blocker), "old")
+
+        os.remove(blocker)
+        self.fix_nums(*self.args)
+        self.assertEqual(self.read(blocker), "x")
+
+    def test_options_kept_apart(self):
+        self.fix_nums(*self.args)
+        s = self.stats(*self.args + ("-D",))
+        self.assertNotIn("settled dirs", s["counts"])
+
+    def test_relocating_onto_a_name_forgets_it(self):
+        path = os.path.join(self.home, "manifest.db")
+        d = os.path.abspath(self.inbox)
+        m = Manifest(path, "key")
+        m.record(os.path.join(d, "a.mkv"), "copy")
+        m.record(os.path.join(d, "b.mkv"), "copy")
+        m.forget(os.path.join(d, "b.mkv"))
+        m.close()
+
+        m = Manifest(path, "key")
+        self.assertEqual(m.known(d), set(["a.mkv"]))
+        m.forget(os.path.join(d, "a.mkv"))
+        m.close()
+        self.assertEqual(Manifest(path, "other").known(d), set())
+        self.assertEqual(Manifest(path, "key").known(d), set())
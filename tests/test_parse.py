@@ -0,0 +1,37 @@
+from tests import ScriptTest
+import fix_nums
+
+
+class EpisodeOnlyTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        self.saved = dict(fix_nums.OPTS)
+
+    def tearDown(self):
+        fix_nums.OPTS.clear()
+        fix_nums.OPTS.update(self.saved)
+        ScriptTest.tearDown(self)
+
+    def test_not_parsed_without_a_show(self):
+        o = fix_nums.FileObject("ep.18-the-rains-of-castamere-repack.mkv")
+        self.assertFalse(o.success)
+
+    def test_parsed_with_show_and_season_given(self):
+        fix_nums.OPTS["SHOWNAME"] = "game of thrones"
+        fix_nums.OPTS["SEASON"] = 3
+        o = fix_nums.FileObject("ep.18-the-rains-of-castamere-repack.mkv")
+        self.assertEqual(o.get()[1], "Game.Of.Thrones/3/Game.Of.Thrones."
+                                     "S3E18.The.Rains.Of.Castamere.mkv")
+
+    def test_run_carries_on(self):
+        self.make("ep.18-the-rains-of-castamere-repack.mkv")
+        self.make("Some.Show.S01E02.mkv")
+        self.make("Some.Show.S01E03.mkv")
+        for processes in ("1", "2"):
+            self.fix_nums("-r", "--no-cache", "--no-manifest",
+                          "--processes", processes, "-o", self.lib)
+        self.assertEqual(self.files(), ["Some.Show/1/Some.Show.S1E02.mkv",
+                                        "Some.Show/1/Some.Show.S1E03.mkv"])
+        self.assertIn("ep.18-the-rains-of-castamere-repack.mkv",
+                      self.files(self.inbox))
@@ -0,0 +1,35 @@
+import os
+import StringIO
+
+from tests import ScriptTest
+import fix_nums
+
+
+class PlanTest(ScriptTest):
+
+    def test_fields_escaped(self):
+        f = StringIO.StringIO()
+        rows = [("Move", "/in/a\tb.mkv", "/lib/a\nb.mkv", ""),
+                ("Skip", "/in/c\\d.mkv", "", "exists")]
+        for row in rows:
+            fix_nums.write_plan(f, *row)
+        self.assertEqual(f.getvalue().count("\n"), 2)
+        f.seek(0)
+        self.assertEqual(list(fix_nums.read_plan(f)), rows)
+
+    def test_applied_as_planned(self):
+        odd = self.make("Some.Show.S01E02.a\tb\\n.mkv")
+        self.make("Some.Show.S01E03.mkv")
+        plan = os.path.join(self.home, "plan")
+        self.fix_nums("--plan", plan, "--no-cache", "-o", self.lib)
+        self.assertEqual(self.files(), [])
+
+        with open(plan) as f:
+            rows = list(fix_nums.read_plan(f))
+        self.assertEqual(len(rows), 2)
+        self.assertIn(odd, [r[1] for r in rows])
+
+        self.fix_nums("--apply", plan)
+        self.assertEqual(self.files(self.inbox), [])
+        self.assertEqual(sorted(os.path.relpath(r[2], self.lib)
+                                for r in rows), self.files())
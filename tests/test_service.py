@@ -0,0 +1,82 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from tests import ScriptTest, SCRIPT
+import service
+
+
+class CoalescingTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        self.batches = []
+        self.service = service.RenameService(None, lambda job: job["key"],
+                                             self.handle, window=0.5)
+
+    def handle(self, jobs):
+        self.batches.append([job["n"] for job in jobs])
+        return [{"n": job["n"]} for job in jobs]
+
+    def test_batched_by_key(self):
+        replies = {}
+
+        def submit(n, key):
+            replies[n] = self.service.submit({"n": n, "key": key})
+
+        threads = [threading.Thread(target=submit, args=(n, key))
+                   for n, key in enumerate("abab")]
+        for t in threads:
+            t.start()
+            # In order, each well within the window
+            time.sleep(0.05)
+        for batch in self.service._collect():
+            self.service._run(batch)
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.batches, [[0, 2], [1, 3]])
+        self.assertEqual(replies, dict((n, {"n": n}) for n in range(4)))
+
+    def test_script_jobs_together(self):
+        sock = os.path.join(self.home, "sock")
+        env = dict(os.environ, HOME=self.home)
+        p = subprocess.Popen([sys.executable, SCRIPT, "--serve", "--socket",
+                              sock, "--no-cache", "--no-manifest",
+                              "-o", self.lib], cwd=self.inbox, env=env,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+        try:
+            for i in range(100):
+                if os.path.exists(sock):
+                    break
+                time.sleep(0.05)
+
+            paths = [self.make("Some.Show.S01E0{0}.mkv".format(i))
+                     for i in (1, 2)]
+            replies = [None] * 2
+
+            def send(i):
+                s = service.client_socket(sock)
+                replies[i] = service.request(s, [paths[i]], self.inbox)
+
+            threads = [threading.Thread(target=send, args=(i,))
+                       for i in (0, 1)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            p.send_signal(signal.SIGINT)
+            out = p.communicate()[0]
+
+        self.assertIn("Stopped after 2 jobs in 1 batches", out)
+
+        self.assertEqual(self.files(), ["Some.Show/1/Some.Show.S1E01.mkv",
+                                        "Some.Show/1/Some.Show.S1E02.mkv"])
+        # Each job only hears about its own file
+        for path, reply in zip(paths, replies):
+            self.assertEqual([r[1] for r in reply["results"]], [path])
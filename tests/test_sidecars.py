@@ -0,0 +1,41 @@
+from tests import ScriptTest
+
+
+class SidecarTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        self.make("some_show_S01E02_HDTV.mkv")
+        self.make("some_show_S01E02_HDTV.en.forced.srt")
+        self.make("some_show_S01E02_HDTV.nfo")
+        self.make("Some Show S01E02 HDTV.jpg")
+        self.make("Other.Show.S01E03.srt")
+        self.make("unrelated.nfo")
+        self.args = ("--no-cache", "--no-manifest", "-o", self.lib)
+
+    def test_moved_with_their_episode(self):
+        self.fix_nums(*self.args)
+        self.assertEqual(self.files(), [
+            "Other.Show/1/Other.Show.S1E03.srt",
+            "Some.Show/1/Some.Show.S1E02.en.forced.srt",
+            "Some.Show/1/Some.Show.S1E02.jpg",
+            "Some.Show/1/Some.Show.S1E02.mkv",
+            "Some.Show/1/Some.Show.S1E02.nfo"])
+        self.assertEqual(self.files(self.inbox), ["unrelated.nfo"])
+
+    def test_subtitles_directory(self):
+        self.fix_nums("--subs", "subs", *self.args)
+        self.assertIn("Some.Show/1/subs/Some.Show.S1E02.en.forced.srt",
+                      self.files())
+        self.assertIn("Some.Show/1/Some.Show.S1E02.nfo", self.files())
+
+    def test_turned_off(self):
+        # Subtitles are renamed on their own, the rest left alone
+        self.fix_nums("--no-sidecars", *self.args)
+        self.assertEqual(self.files(), [
+            "Other.Show/1/Other.Show.S1E03.srt",
+            "Some.Show/1/Some.Show.S1E02.En.Forced.srt",
+            "Some.Show/1/Some.Show.S1E02.mkv"])
+        self.assertEqual(self.files(self.inbox), [
+            "Some Show S01E02 HDTV.jpg", "some_show_S01E02_HDTV.nfo",
+            "unrelated.nfo"])
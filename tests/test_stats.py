@@ -0,0 +1,52 @@
+import os
+
+from tests import ScriptTest
+
+
+class StatsTest(ScriptTest):
+
+    def setUp(self):
+        ScriptTest.setUp(self)
+        for i in range(1, 41):
+            self.make("Some.Show.S01E{0:02d}.720p.HDTV.x264.mkv".format(i))
+        self.args = ("-R", "-x", "--no-cache", "--no-manifest", "-o", self.lib)
+
+    def test_phases_timed_on_pipeline_stages(self):
+        s = self.stats(*self.args)
+        self.assertGreater(s["phases"].get("parse", 0), 0)
+        self.assertGreater(s["phases"].get("scan", 0), 0)
+        self.assertGreater(s["phases"].get("render", 0), 0)
+
+    def test_phases_timed_in_turn(self):
+        s = self.stats(*self.args + ("--queue", "0"))
+        self.assertGreater(s["phases"].get("parse", 0), 0)
+        self.assertGreater(s["phases"].get("scan", 0), 0)
+
+    def test_pattern_counts_from_parse_workers(self):
+        self.make("the_office_us_5x12_Prince_Family_Paper.mp4")
+        self.make("parks.and.recreation.512.hdtv-lol.avi")
+        alone = self.stats(*self.args)
+        pooled = self.stats(*self.args + ("--processes", "2"))
+        self.assertEqual(pooled["patterns"], alone["patterns"])
+        self.assertEqual(sum(p["matched"] for p in pooled["patterns"]), 42)
+        self.assertGreater(pooled["phases"].get("parse", 0), 0)
+
+    def test_one_stat_per_media_file(self):
+        for i in range(10):
+            self.make("notes{0}.txt".format(i))
+        self.make("Extras/Some.Show.S02E01.mkv")
+        s = self.stats(*self.args[1:])
+        self.assertEqual(s["counts"]["stat"], 40)
+        s = self.stats(*self.args)
+        self.assertEqual(s["counts"]["stat"], 52)
+
+    def test_dry_run_counted_as_planned(self):
+        s = self.stats(*self.args)
+        self.assertEqual(s["counts"]["planned"], 40)
+        self.assertNotIn("relocated", s["counts"])
+        self.assertNotIn("bytes", s["counts"])
+
+    def test_destination_listings_counted(self):
+        # The inbox, then the show's season directory in the library once
+        s = self.stats(*self.args[1:])
+        self.assertEqual(s["counts"]["listdir"], 2)
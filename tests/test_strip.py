@@ -0,0 +1,46 @@
+import unittest
+
+import fix_nums
+
+
+class StripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = list(fix_nums.STRIP)
+
+    def tearDown(self):
+        fix_nums.STRIP[:] = self.saved
+
+    def new_name(self, name):
+        return fix_nums.FileObject(name).get()[1]
+
+    def test_plain_and_punctuated_terms(self):
+        self.assertEqual(
+            self.new_name("the_office_us_5x12_Prince_Family_Paper_720p_"
+                          "WEB-DL.mp4"),
+            "The.Office.Us/5/The.Office.Us.S5E12.Prince.Family.Paper.mp4")
+        self.assertEqual(
+            self.new_name("Game-of-Thrones-S03E09-The-Rains-of-Castamere-"
+                          "1080p-AAC2.0-CtrlHD.mkv"),
+            "Game.Of.Thrones/3/Game.Of.Thrones.S3E09.The.Rains.Of."
+            "Castamere.mkv")
+
+    def test_only_whole_terms_removed(self):
+        fix_nums.STRIP.append("g-1.x")
+        self.assertEqual(self.new_name("Show.S01E02.Ag-1.x.mkv"),
+                         "Show/1/Show.S1E02.Ag.1.X.mkv")
+        self.assertEqual(self.new_name("Show.S01E02.Title.g-1.x.mkv"),
+                         "Show/1/Show.S1E02.Title.mkv")
+
+    def test_longest_term_wins(self):
+        fix_nums.STRIP.extend(["part", "part-two.cut"])
+        self.assertEqual(self.new_name("Show.S01E02.Title.part-two.cut.mkv"),
+                         "Show/1/Show.S1E02.Title.mkv")
+
+    def test_many_terms_one_pass(self):
+        fix_nums.STRIP.extend("g-{0:04d}.x".format(i) for i in range(700))
+        fix_nums.STRIP.extend("grp{0:04d}".format(i) for i in range(300))
+        self.assertEqual(len(fix_nums.strip_passes()), 1)
+        self.assertEqual(self.new_name("Show.S01E02.Title.g-0699.x.grp0299."
+                                       "hdtv.mkv"),
+                         "Show/1/Show.S1E02.Title.mkv")
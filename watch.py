@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Watching a directory for finished downloads.
+
+New files are found with inotify on Linux, or by polling directory mtimes
+anywhere else, and are only handed over once their size has stopped
+changing. Files that become ready close together are returned as one
+batch.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+LOG = logging.getLogger()
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+
+_EVENT = struct.Struct("iIII")
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class _InotifySource:
+    """ Reports paths of created, written or moved in files using inotify """
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, libc, top, recursive, descend):
+        self.libc = libc
+        self.recursive = recursive
+        self.descend = descend
+        self.dirs = {}
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._found = self._add_tree(top)
+
+    def _add_tree(self, top):
+        """ Watches top (and below it when recursive), returns its files """
+        found = []
+        pending = [top]
+
+        while pending:
+            d = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, d, self.MASK)
+            if wd < 0:
+                LOG.info("Cannot watch {0} - {1}".format(
+                         d, os.strerror(ctypes.get_errno())))
+                continue
+            self.dirs[wd] = d
+
+            for name in _listdir(d):
+                path = os.path.join(d, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    if self.recursive and self.descend(path):
+                        pending.append(path)
+                else:
+                    found.append(path)
+
+        return found
+
+    def changes(self, timeout):
+        found, self._found = self._found, []
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return found
+
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+            return found
+
+        i = 0
+        while i < len(data):
+            wd, mask, _, size = _EVENT.unpack_from(data, i)
+            name = data[i + _EVENT.size:i + _EVENT.size + size].rstrip("\0")
+            i += _EVENT.size + size
+
+            if mask & IN_Q_OVERFLOW:
+                LOG.info("Watch queue overflowed, searching again")
+                for d in set(self.dirs.values()):
+                    found.extend(os.path.join(d, n) for n in _listdir(d))
+                continue
+
+            if wd not in self.dirs or not name:
+                continue
+            path = os.path.join(self.dirs[wd], name)
+
+            if mask & IN_ISDIR:
+                if self.recursive and self.descend(path):
+                    found.extend(self._add_tree(path))
+            else:
+                found.append(path)
+
+        return found
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _PollSource:
+    """
+    Reports new or changed files by polling, only directories whose mtime
+    has changed are listed again.
+    """
+
+    def __init__(self, top, recursive, descend):
+        self.top = top
+        self.recursive = recursive
+        self.descend = descend
+        self.dirs = {}
+        self.files = {}
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        found = []
+
+        if not self.dirs:
+            self.dirs[self.top] = None
+
+        for d, seen in self.dirs.items():
+            try:
+                mtime = os.stat(d).st_mtime
+            except OSError:
+                del self.dirs[d]
+                continue
+
+            # Changes within the mtime granularity could otherwise be missed
+            if mtime == seen and time.time() - mtime > 2:
+                continue
+            self.dirs[d] = mtime
+            known = self.files.get(d, {})
+            files = {}
+
+            for name in _listdir(d):
+                path = os.path.join(d, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+
+                if os.path.isdir(path):
+                    if (self.recursive and path not in self.dirs and
+                            not os.path.islink(path) and self.descend(path)):
+                        self.dirs[path] = None
+                    continue
+
+                files[name] = (st.st_size, st.st_mtime)
+                if known.get(name) != files[name]:
+                    found.append(path)
+
+            self.files[d] = files
+
+        return found
+
+    def close(self):
+        pass
+
+
+def _listdir(d):
+    try:
+        return os.listdir(d)
+    except OSError, e:
+        LOG.info("Cannot search {0} - {1}".format(d, e.strerror))
+        return []
+
+
+class Watcher:
+    """
+    Yields batches of paths below top that wanted(path) accepts once each
+    has kept the same size for settle seconds. A batch is handed over when
+    no other file has become ready for debounce seconds.
+
+    descend(path) decides which directories are watched when recursive.
+    """
+
+    def __init__(self, top, wanted, descend, recursive=False,
+                 settle=5.0, debounce=2.0, interval=1.0, poll=False):
+        self.top = top
+        self.wanted = wanted
+        self.settle = settle
+        self.debounce = debounce
+        self.interval = interval
+
+        libc = None if poll else _libc()
+        self.source = None
+        if libc:
+            try:
+                self.source = _InotifySource(libc, top, recursive, descend)
+            except OSError, e:
+                LOG.info("inotify unavailable - {0}, polling".format(
+                         e.strerror))
+        if not self.source:
+            self.source = _PollSource(top, recursive, descend)
+
+    def batches(self):
+        pending = {}
+        ready = []
+        last_ready = 0
+
+        try:
+            while True:
+                now = time.time()
+                for path in self.source.changes(self.interval):
+                    if self.wanted(path):
+                        pending[path] = (None, now)
+
+                now = time.time()
+                for path, (seen, since) in pending.items():
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        del pending[path]
+                        continue
+
+                    size = (st.st_size, st.st_mtime)
+                    if size != seen:
+                        pending[path] = (size, now)
+                    elif now - since >= self.settle:
+                        del pending[path]
+                        ready.append(path)
+                        last_ready = now
+
+                if ready and now - last_ready >= self.debounce:
+                    batch, ready = sorted(ready), []
+                    yield batch
+        finally:
+            self.source.close()